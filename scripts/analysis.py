@@ -4,7 +4,9 @@ import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 from create_datacube import build_dynamic_query
-from utils import execute_sql_query
+from cube_cache import get_cube
+from utils import dim_table_map, execute_sql_query, report_statement_cache
+from result_writers import output_formats, write_result
 
 
 analysis_tasks = [
@@ -139,11 +141,35 @@ analysis_tasks = [
             "y_label": "Average Runtime (minutes)",
             "annotate": "averageRating"
         }
+    },
+    {
+        "index": 6,
+        "problem_description": "Compare average ratings across decades. The decade cube is rolled up from the cached year cube instead of scanning the fact table again.",
+        "auto_generate": True,
+        "SQL_query_params": {
+            "selected_measures": ["averageRating"],
+            "selected_dims": ["decade"]
+        },
+        "SQL_query": "auto",
+        "output": {
+            "data_file": "6.csv",
+            "figure_file": "6.png"
+        },
+        "visualization_details": {
+            "chart_type": "bar",
+            "axes_info": {
+                "x_axis": "decade",
+                "y_axis": "averageRating"
+            },
+            "title": "Average Movie Ratings by Decade",
+            "x_label": "Decade",
+            "y_label": "Average Rating"
+        }
     }
 ]
 
 
-def run_analysis_engine(task, output_folder):
+def run_analysis_engine(task, output_folder, output_format=None):
     # Ensure output directory exists
     os.makedirs(output_folder, exist_ok=True)
 
@@ -151,17 +177,21 @@ def run_analysis_engine(task, output_folder):
 
     # Build and execute the SQL query
     if task['auto_generate']:
-        query = build_dynamic_query(task['SQL_query_params']['selected_measures'],
-                                    task['SQL_query_params']['selected_dims'])
+        selected_measures = task['SQL_query_params']['selected_measures']
+        selected_dims = task['SQL_query_params']['selected_dims']
+        if all(dim in dim_table_map for dim in selected_dims):
+            query, params = build_dynamic_query(selected_measures, selected_dims,
+                                                filters=task['SQL_query_params'].get('filters'))
+            df = execute_sql_query(query, params)
+        else:
+            # Derived hierarchy levels are rolled up from a cached finer cube
+            df = get_cube(selected_measures, selected_dims)
     else:
-        query = task['SQL_query']
+        df = execute_sql_query(task['SQL_query'])
 
-    df = execute_sql_query(query)
-
-    # Save the result data to a CSV file
-    csv_file_path = os.path.join(output_folder, task['output']['data_file'])
-    df.to_csv(csv_file_path, index=False)
-    print(f"Data saved to {csv_file_path}")
+    # Save the result data, as CSV unless another format is requested
+    data_file_path = write_result(df, os.path.join(output_folder, task['output']['data_file']), output_format)
+    print(f"Data saved to {data_file_path}")
 
     # Visualization
     if 'figure_file' in task['output']:
@@ -214,6 +244,7 @@ def main():
     parser.add_argument('--task', nargs='*', default='all', help='Specify the analysis tasks to run by index or "all" for all tasks.')
     parser.add_argument('--run', action='store_true', help='Run the specified analysis tasks.')
     parser.add_argument('--output', default='../analysis_results', help='Specify the output folder for analysis results. Default is "../analysis_results"')
+    parser.add_argument('--format', choices=list(output_formats), help='Write the result data in this format instead of the task\'s CSV file.')
 
     # Check if no arguments were provided (just the script name)
     if len(sys.argv) == 1:
@@ -246,10 +277,12 @@ def main():
         for index in task_indices:
             task = next((task for task in analysis_tasks if task['index'] == index), None)
             if task:
-                run_analysis_engine(task, output_folder=args.output)
+                run_analysis_engine(task, output_folder=args.output, output_format=args.format)
             else:
                 print(f"Warning: Task {index} does not exist in the task list.")
 
+        report_statement_cache()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,217 @@
+import os
+import re
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from star_schema import read_star_csv, load_star_tables
+from star_links import csr_gather, build_links_index, load_star_links
+
+
+def build_bitmap_index(bridge_df, key_column, member_column, keys, member_labels):
+    # One packed bitmap per member (genre, profession) over the key ordinals (movies, persons)
+    key_ordinals = pd.Index(keys).get_indexer(bridge_df[key_column])
+    member_codes = pd.Index(member_labels.index).get_indexer(bridge_df[member_column])
+    matched = (key_ordinals >= 0) & (member_codes >= 0)
+    member_codes, key_ordinals = member_codes[matched], key_ordinals[matched]
+
+    # Set each bit in place, most significant bit first like np.packbits
+    bitmaps = np.zeros((len(member_labels), (len(keys) + 7) // 8), dtype=np.uint8)
+    np.bitwise_or.at(bitmaps, (member_codes, key_ordinals >> 3), (0x80 >> (key_ordinals & 7)).astype(np.uint8))
+
+    return {
+        'keys': np.asarray(keys, dtype=str),
+        'names': np.asarray(member_labels.values, dtype=str),
+        'bitmaps': bitmaps,
+    }
+
+
+def build_genre_index(tables):
+    genre_labels = tables['DimGenre'].set_index('genreId')['genreName']
+    return build_bitmap_index(tables['Bridge_MovieGenres'], 'movieId', 'genreId',
+                              tables['DimMovie']['movieId'], genre_labels)
+
+
+def build_profession_index(tables):
+    profession_labels = tables['DimProfession'].set_index('professionId')['profession']
+    return build_bitmap_index(tables['Bridge_PrincipalProfessions'], 'personId', 'professionId',
+                              tables['DimPerson']['personId'], profession_labels)
+
+
+def save_bitmap_index(index, path):
+    # Packed bitmaps are further zlib-compressed on disk
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(path, **index)
+
+
+def load_bitmap_index(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+# Index files written together with the star links, so their movie and person ordinals always agree
+index_builders = {
+    'genres': build_genre_index,
+    'professions': build_profession_index,
+}
+
+
+def build_star_indexes(tables, index_folder='../bitmap_index/'):
+    # Called by the ETL after validation, so the indexes match the loaded tables
+    indexes = {name: builder(tables) for name, builder in index_builders.items()}
+    for name, index in indexes.items():
+        save_bitmap_index(index, os.path.join(index_folder, name + '.npz'))
+    return indexes
+
+
+def bitmap_for(index, name):
+    matches = np.flatnonzero(np.char.lower(index['names']) == name.lower())
+    if len(matches) == 0:
+        raise ValueError(f"Unknown member '{name}'. Available: {', '.join(index['names'])}")
+    return index['bitmaps'][matches[0]]
+
+
+def bitmap_not(index, bitmap):
+    # Flip every bit, then clear the padding bits past the last ordinal
+    result = np.bitwise_not(bitmap)
+    padding = (-len(index['keys'])) % 8
+    if padding:
+        result[-1] &= np.uint8(0xFF << padding & 0xFF)
+    return result
+
+
+def tokenize(expression):
+    return re.findall(r'\(|\)|[^\s()]+', expression)
+
+
+def evaluate_expression(index, expression):
+    # Recursive descent over: or := and (OR and)*, and := not (AND not)*, not := NOT not | name | (or)
+    tokens = tokenize(expression)
+    position = 0
+
+    def peek():
+        return tokens[position].upper() if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        result = parse_and()
+        while peek() == 'OR':
+            take()
+            result = np.bitwise_or(result, parse_and())
+        return result
+
+    def parse_and():
+        result = parse_not()
+        while peek() == 'AND':
+            take()
+            result = np.bitwise_and(result, parse_not())
+        return result
+
+    def parse_not():
+        if peek() == 'NOT':
+            take()
+            return bitmap_not(index, parse_not())
+        if peek() == '(':
+            take()
+            result = parse_or()
+            if peek() != ')':
+                raise ValueError(f"Missing ')' in expression: {expression}")
+            take()
+            return result
+        if peek() is None or peek() in ('AND', 'OR', ')'):
+            raise ValueError(f"Unexpected end of term in expression: {expression}")
+        return bitmap_for(index, take())
+
+    result = parse_or()
+    if position != len(tokens):
+        raise ValueError(f"Unexpected token '{tokens[position]}' in expression: {expression}")
+    return result
+
+
+def bitmap_to_mask(index, bitmap):
+    return np.unpackbits(bitmap, count=len(index['keys'])).astype(bool)
+
+
+def bitmap_keys(index, bitmap):
+    return index['keys'][bitmap_to_mask(index, bitmap)]
+
+
+def select_facts(links, movie_mask):
+    # Boolean mask over fact rows whose movie is selected, by ordinal lookup
+    fact_movies = links['fact_movie_ordinals']
+    return (fact_movies >= 0) & movie_mask[fact_movies]
+
+
+def movies_with_people(links, person_mask):
+    # Scatter the movies of every selected person through the person -> movie CSR
+    movies, _ = csr_gather(links['person_movie_indptr'], links['person_movie_indices'], np.flatnonzero(person_mask))
+    movie_mask = np.zeros(len(links['movie_keys']), dtype=bool)
+    movie_mask[movies] = True
+    return movie_mask
+
+
+def aggregate_selection(fact_df, mask):
+    selected = fact_df[mask]
+    return pd.DataFrame({
+        'movies': [len(selected)],
+        'averageRating': [selected['averageRating'].mean()],
+        'numVotes': [selected['numVotes'].sum()],
+    })
+
+
+def load_or_build_indexes(index_folder, links_path, data_folder, rebuild):
+    paths = {name: os.path.join(index_folder, name + '.npz') for name in index_builders}
+    if rebuild or not all(os.path.exists(path) for path in [links_path, *paths.values()]):
+        tables = load_star_tables(data_folder)
+        return build_star_indexes(tables, index_folder), build_links_index(tables, links_path)
+    return {name: load_bitmap_index(path) for name, path in paths.items()}, load_star_links(links_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Filter movies and people with bitmap indexes over the bridge tables.')
+    parser.add_argument('--genres', help='Boolean genre expression, e.g. "Crime AND Drama AND NOT Comedy".')
+    parser.add_argument('--professions', help='Boolean profession expression, e.g. "director AND writer".')
+    parser.add_argument('--after', type=int, help='Only keep facts with a dateKey after this year.')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the bitmap indexes from the star schema CSV files.')
+    parser.add_argument('--data', default='../datasets_validated/',
+                        help='Specify the folder holding the validated star schema CSV files. Default is "../datasets_validated/".')
+    parser.add_argument('--index', default='../bitmap_index/',
+                        help='Specify the folder for the bitmap index files. Default is "../bitmap_index/".')
+    parser.add_argument('--links', default='../star_index/links.npz',
+                        help='Specify the star links file shared with the collaboration graph. Default is "../star_index/links.npz".')
+
+    # Check if no arguments were provided (just the script name)
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    indexes, links = load_or_build_indexes(args.index, args.links, args.data, args.rebuild)
+    fact_df = read_star_csv('Fact_MovieData', os.path.join(args.data, 'Fact_MovieData.csv'))
+    if len(fact_df) != len(links['fact_movie_ordinals']) or len(indexes['genres']['keys']) != len(links['movie_keys']):
+        parser.error(f'The bitmap indexes in {args.index} were built from other data; pass --rebuild.')
+    movie_mask = np.ones(len(links['movie_keys']), dtype=bool)
+
+    if args.genres:
+        genre_index = indexes['genres']
+        movie_mask &= bitmap_to_mask(genre_index, evaluate_expression(genre_index, args.genres))
+
+    if args.professions:
+        profession_index = indexes['professions']
+        person_mask = bitmap_to_mask(profession_index, evaluate_expression(profession_index, args.professions))
+        print(f'{person_mask.sum()} people match "{args.professions}"')
+        movie_mask &= movies_with_people(links, person_mask)
+
+    mask = select_facts(links, movie_mask)
+    if args.after is not None:
+        mask &= (fact_df['dateKey'] > args.after).to_numpy()
+
+    print(aggregate_selection(fact_df, mask).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from star_schema import read_star_csv
+from star_links import csr_from_pairs, csr_gather, build_links_index, load_star_links
+
+
+def read_graph_tables(data_folder):
+    names = ['DimPerson', 'DimMovie', 'Bridge_MoviePrincipals', 'Fact_MovieData']
+    return {name: read_star_csv(name, os.path.join(data_folder, name + '.csv')) for name in names}
+
+
+def build_collaboration_graph(tables, links):
+    # Person -> movie memberships come from the shared star links, one entry per person and movie
+    person_keys, movie_keys = links['person_keys'], links['movie_keys']
+    person_movie_indptr = links['person_movie_indptr']
+    member_persons = np.repeat(np.arange(len(person_keys)), np.diff(person_movie_indptr))
+    member_movies = links['person_movie_indices'].astype(np.int64)
+
+    # Movie -> person adjacency, used to expand every movie into its cast pairs
+    by_movie = np.lexsort((member_persons, member_movies))
+    member_persons, member_movies = member_persons[by_movie], member_movies[by_movie]
+    movie_person_indptr, movie_person_indices = csr_from_pairs(member_movies, member_persons, len(movie_keys))
+
+    # Every ordered pair of distinct people sharing a movie, with that movie
+    partners, owners = csr_gather(movie_person_indptr, movie_person_indices, member_movies)
+    source_persons, pair_movies = member_persons[owners], member_movies[owners]
+    distinct = source_persons != partners
+    source_persons, partners, pair_movies = source_persons[distinct], partners[distinct], pair_movies[distinct]
+
+    # Movie measures by ordinal; the fact table holds one row per movie
+    fact_df = tables['Fact_MovieData']
+    fact_ordinals = links['fact_movie_ordinals']
+    known = fact_ordinals >= 0
+    ratings = np.full(len(movie_keys), np.nan)
+    votes = np.zeros(len(movie_keys), dtype=np.int64)
+    ratings[fact_ordinals[known]] = fact_df['averageRating'].to_numpy(dtype=np.float64, na_value=np.nan)[known]
+    votes[fact_ordinals[known]] = fact_df['numVotes'].to_numpy(dtype=np.int64, na_value=0)[known]
+
+    # Collapse the pairs into weighted edges, sorted by source then partner
+    edge_keys, edge_ids = np.unique(source_persons * np.int64(len(person_keys)) + partners, return_inverse=True)
+    pair_ratings = ratings[pair_movies]
+    rated = ~np.isnan(pair_ratings)
+    rating_sum = np.bincount(edge_ids[rated], weights=pair_ratings[rated], minlength=len(edge_keys))
+    rating_count = np.bincount(edge_ids[rated], minlength=len(edge_keys))
+    collab_indptr, collab_indices = csr_from_pairs(edge_keys // len(person_keys), edge_keys % len(person_keys), len(person_keys))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_rating = rating_sum / rating_count
+
+    # Keys and the person -> movie CSR stay in the links file; load_collaboration_graph joins them back
+    return {
+        'person_names': np.asarray(tables['DimPerson']['name'], dtype=str),
+        'movie_titles': np.asarray(tables['DimMovie']['primaryTitle'], dtype=str),
+        'movie_ratings': ratings,
+        'movie_votes': votes,
+        'collab_indptr': collab_indptr,
+        'collab_indices': collab_indices.astype(np.int32),
+        'shared_movies': np.bincount(edge_ids, minlength=len(edge_keys)).astype(np.int32),
+        'mean_rating': mean_rating,
+        'total_votes': np.bincount(edge_ids, weights=votes[pair_movies], minlength=len(edge_keys)).astype(np.int64),
+    }
+
+
+def save_collaboration_graph(graph, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(path, **graph)
+
+
+def load_collaboration_graph(path, links_path):
+    with np.load(path) as data:
+        graph = {name: data[name] for name in data.files}
+    return {**load_star_links(links_path), **graph}
+
+
+def build_graph_index(tables, links, path):
+    # Called by the ETL right after the star links, from the same validated tables
+    graph = build_collaboration_graph(tables, links)
+    save_collaboration_graph(graph, path)
+    return {**links, **graph}
+
+
+def person_ordinal(graph, person):
+    # Accept a personId (nm...) or an exact, case-insensitive name
+    matches = np.flatnonzero(graph['person_keys'] == person)
+    if len(matches) == 0:
+        matches = np.flatnonzero(np.char.lower(graph['person_names']) == person.lower())
+    if len(matches) == 0:
+        raise ValueError(f"Unknown person '{person}'.")
+    if len(matches) > 1:
+        raise ValueError(f"Ambiguous name '{person}', use one of: {', '.join(graph['person_keys'][matches])}")
+    return matches[0]
+
+
+def person_movies(graph, person):
+    ordinal = person_ordinal(graph, person)
+    indptr = graph['person_movie_indptr']
+    return graph['movie_keys'][graph['person_movie_indices'][indptr[ordinal]:indptr[ordinal + 1]]]
+
+
+def edges_frame(graph, edges):
+    partners = graph['collab_indices'][edges]
+    return pd.DataFrame({
+        'personId': graph['person_keys'][partners],
+        'name': graph['person_names'][partners],
+        'sharedMovies': graph['shared_movies'][edges],
+        'averageRating': graph['mean_rating'][edges],
+        'numVotes': graph['total_votes'][edges],
+    })
+
+
+def neighbors(graph, person):
+    ordinal = person_ordinal(graph, person)
+    indptr = graph['collab_indptr']
+    return edges_frame(graph, np.arange(indptr[ordinal], indptr[ordinal + 1]))
+
+
+def top_collaborators(graph, person, k=10, by='sharedMovies'):
+    # Partial sort of one adjacency row; ties on shared movies go to the better rated pairing
+    ordinal = person_ordinal(graph, person)
+    indptr = graph['collab_indptr']
+    edges = np.arange(indptr[ordinal], indptr[ordinal + 1])
+    weights = {'sharedMovies': 'shared_movies', 'averageRating': 'mean_rating', 'numVotes': 'total_votes'}
+    if by not in weights:
+        raise ValueError(f"Unknown ranking '{by}'. Available: {', '.join(weights)}")
+    scores = np.nan_to_num(graph[weights[by]][edges].astype(np.float64), nan=-np.inf)
+    if k < len(edges):
+        # Keep everything tied with the k-th score, so the tie-break below sees all of it
+        threshold = -np.partition(-scores, k - 1)[k - 1]
+        edges, scores = edges[scores >= threshold], scores[scores >= threshold]
+    return edges_frame(graph, edges).assign(score=scores).sort_values(['score', 'averageRating'], ascending=False) \
+        .head(k).drop(columns='score').reset_index(drop=True)
+
+
+def collaboration(graph, person, partner):
+    # Adjacency rows are sorted by partner ordinal, so one binary search finds the edge
+    ordinal, partner_ordinal = person_ordinal(graph, person), person_ordinal(graph, partner)
+    indptr = graph['collab_indptr']
+    row = graph['collab_indices'][indptr[ordinal]:indptr[ordinal + 1]]
+    position = np.searchsorted(row, partner_ordinal)
+    if position == len(row) or row[position] != partner_ordinal:
+        return edges_frame(graph, np.array([], dtype=np.int64))
+    return edges_frame(graph, np.array([indptr[ordinal] + position]))
+
+
+def shared_movies(graph, person, partner):
+    # Both person -> movie rows are sorted, so the shared movies are their intersection
+    indptr, indices = graph['person_movie_indptr'], graph['person_movie_indices']
+    ordinal, partner_ordinal = person_ordinal(graph, person), person_ordinal(graph, partner)
+    movies = np.intersect1d(indices[indptr[ordinal]:indptr[ordinal + 1]],
+                            indices[indptr[partner_ordinal]:indptr[partner_ordinal + 1]], assume_unique=True)
+    return pd.DataFrame({
+        'movieId': graph['movie_keys'][movies],
+        'primaryTitle': graph['movie_titles'][movies],
+        'averageRating': graph['movie_ratings'][movies],
+        'numVotes': graph['movie_votes'][movies],
+    }).sort_values('averageRating', ascending=False, ignore_index=True)
+
+
+def k_hop(graph, person, hops=2):
+    # Breadth-first expansion, one vectorized CSR gather per hop
+    ordinal = person_ordinal(graph, person)
+    distance = np.full(len(graph['person_keys']), -1, dtype=np.int32)
+    distance[ordinal] = 0
+    frontier = np.array([ordinal])
+    for hop in range(1, hops + 1):
+        reached, _ = csr_gather(graph['collab_indptr'], graph['collab_indices'], frontier)
+        frontier = np.unique(reached[distance[reached] < 0])
+        if len(frontier) == 0:
+            break
+        distance[frontier] = hop
+    reached = np.flatnonzero(distance > 0)
+    return pd.DataFrame({
+        'personId': graph['person_keys'][reached],
+        'name': graph['person_names'][reached],
+        'hops': distance[reached],
+    }).sort_values(['hops', 'name'], ignore_index=True)
+
+
+def load_or_build_graph(path, links_path, data_folder, rebuild):
+    if rebuild or not os.path.exists(path) or not os.path.exists(links_path):
+        tables = read_graph_tables(data_folder)
+        return build_graph_index(tables, build_links_index(tables, links_path), path)
+    graph = load_collaboration_graph(path, links_path)
+    if len(graph['person_names']) != len(graph['person_keys']):
+        raise ValueError(f'The graph in {path} was built from other data than {links_path}; pass --rebuild.')
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the precomputed collaboration graph of people sharing movies.')
+    parser.add_argument('--person', required=True, help='personId or exact name of the person to start from.')
+    parser.add_argument('--with', dest='partner', help='Report the movies shared with this personId or name.')
+    parser.add_argument('--top', type=int, default=10, help='Number of top collaborators to list. Default is 10.')
+    parser.add_argument('--by', choices=['sharedMovies', 'averageRating', 'numVotes'], default='sharedMovies',
+                        help='Rank collaborators by this edge weight. Default is sharedMovies.')
+    parser.add_argument('--hops', type=int, help='List everyone reachable within this many collaborations instead.')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the graph from the star schema CSV files.')
+    parser.add_argument('--data', default='../datasets_validated/',
+                        help='Specify the folder holding the validated star schema CSV files. Default is "../datasets_validated/".')
+    parser.add_argument('--index', default='../graph_index/collaboration.npz',
+                        help='Specify the graph index file. Default is "../graph_index/collaboration.npz".')
+    parser.add_argument('--links', default='../star_index/links.npz',
+                        help='Specify the star links file shared with the bitmap indexes. Default is "../star_index/links.npz".')
+
+    # Check if no arguments were provided (just the script name)
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    graph = load_or_build_graph(args.index, args.links, args.data, args.rebuild)
+
+    start_time = time.perf_counter()
+    if args.partner:
+        print(collaboration(graph, args.person, args.partner).to_string(index=False))
+        result_df = shared_movies(graph, args.person, args.partner)
+    elif args.hops is not None:
+        result_df = k_hop(graph, args.person, args.hops)
+    else:
+        result_df = top_collaborators(graph, args.person, args.top, args.by)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+    print(result_df.to_string(index=False))
+    print(f'{len(result_df)} rows in {elapsed_ms:.2f} ms')
+
+
+if __name__ == "__main__":
+    main()
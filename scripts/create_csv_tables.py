@@ -1,119 +1,134 @@
 import os
+import argparse
 import pandas as pd
+from etl_metrics import start_run, finish_run, track_stage, record_rows
+from delta_etl import write_star_deltas
+from validate_star import validate_star
+from bitmap_index import build_star_indexes
+from star_schema import cast_frame, write_star_csv, load_star_tables
+from star_links import build_links_index
+from collab_graph import build_graph_index
 
 
-def create_dim_movie(movies_csv_path, save_path):
+def create_dim_movie(movies_csv_path, save_path, stage=None):
     # Load the movies data
     movies_df = pd.read_csv(movies_csv_path)
+    record_rows(stage, rows_in=len(movies_df))
     
     # Create the DimMovie DataFrame by selecting relevant columns
     dim_movie = movies_df[['tconst', 'titleType', 'primaryTitle', 'originalTitle', 'isAdult', 'startYear', 'endYear', 'runtimeMinutes']].copy()
     dim_movie.rename(columns={'tconst': 'movieId'}, inplace=True)
 
-    # Convert isAdult to a boolean type
-    dim_movie['isAdult'] = dim_movie['isAdult'].astype(bool)
-
-    # Replace '\\N' with the string 'NULL'
-    dim_movie['startYear'].replace('\\N', 'NULL', inplace=True)
-    dim_movie['endYear'].replace('\\N', 'NULL', inplace=True)
-    
-    # Save the DimMovie DataFrame to a CSV file
-    dim_movie.to_csv(os.path.join(save_path, 'DimMovie.csv'), index=False)
+    # Cast to the registry dtypes, turning '\\N' markers into NULL, and save the DimMovie DataFrame to a CSV file
+    dim_movie = cast_frame(dim_movie, 'DimMovie')
+    write_star_csv(dim_movie, 'DimMovie', os.path.join(save_path, 'DimMovie.csv'))
     
+    record_rows(stage, rows_out=len(dim_movie))
     return dim_movie
 
 
 # Function to create DimGenre
-def create_dim_genre(movies_csv_path, save_path):
+def create_dim_genre(movies_csv_path, save_path, stage=None):
     # Load the genres data
     genres_df = pd.read_csv(movies_csv_path)
+    record_rows(stage, rows_in=len(genres_df))
     
-    # Save the DimGenre DataFrame to a CSV file
-    genres_df.to_csv(save_path + 'DimGenre.csv', index=False)
+    # Cast to the registry dtypes and save the DimGenre DataFrame to a CSV file
+    genres_df = cast_frame(genres_df, 'DimGenre')
+    write_star_csv(genres_df, 'DimGenre', save_path + 'DimGenre.csv')
     
+    record_rows(stage, rows_out=len(genres_df))
     return genres_df
 
 
 # Function to create Bridge_MovieGenres
-def create_bridge_movie_genres(movies_csv_path, save_path):
+def create_bridge_movie_genres(movies_csv_path, save_path, stage=None):
     # Load the movie genres data
     movie_genres_df = pd.read_csv(movies_csv_path)
+    record_rows(stage, rows_in=len(movie_genres_df))
     
     # Rename the columns to match the star schema
     movie_genres_df.rename(columns={'tconst': 'movieId', 'genreId': 'genreId'}, inplace=True)
     
-    # Save the Bridge_MovieGenres DataFrame to a CSV file
-    movie_genres_df.to_csv(save_path + 'Bridge_MovieGenres.csv', index=False)
+    # Cast to the registry dtypes and save the Bridge_MovieGenres DataFrame to a CSV file
+    movie_genres_df = cast_frame(movie_genres_df, 'Bridge_MovieGenres')
+    write_star_csv(movie_genres_df, 'Bridge_MovieGenres', save_path + 'Bridge_MovieGenres.csv')
     
+    record_rows(stage, rows_out=len(movie_genres_df))
     return movie_genres_df
 
 
 # Function to create DimPerson
-def create_dim_person(names_csv_path, save_path):
+def create_dim_person(names_csv_path, save_path, stage=None):
     # Load the names data
     names_df = pd.read_csv(names_csv_path)
+    record_rows(stage, rows_in=len(names_df))
     
     # Rename the columns to match the star schema
     names_df.rename(columns={'nconst': 'personId', 'primaryName': 'name', 
                              'birthYear': 'birthYear', 'deathYear': 'deathYear'}, inplace=True)
     
-    # Replace '\\N' with the string 'NULL'
-    names_df['birthYear'].replace('\\N', 'NULL', inplace=True)
-    names_df['deathYear'].replace('\\N', 'NULL', inplace=True)
-    
-    # Save the DimPerson DataFrame to a CSV file
-    names_df.to_csv(os.path.join(save_path, 'DimPerson.csv'), index=False)
+    # Cast to the registry dtypes and save the DimPerson DataFrame to a CSV file
+    names_df = cast_frame(names_df, 'DimPerson')
+    write_star_csv(names_df, 'DimPerson', os.path.join(save_path, 'DimPerson.csv'))
     
+    record_rows(stage, rows_out=len(names_df))
     return names_df
 
 
-def create_dim_profession(professions_csv_path, save_path):
+def create_dim_profession(professions_csv_path, save_path, stage=None):
     # Load the professions data
     professions_df = pd.read_csv(professions_csv_path)
+    record_rows(stage, rows_in=len(professions_df))
     
     # Rename the columns to match the star schema
     professions_df.rename(columns={'professionId': 'professionId', 'profession': 'profession'}, inplace=True)
     
-    # Save the DimProfession DataFrame to a CSV file
-    professions_df.to_csv(os.path.join(save_path, 'DimProfession.csv'), index=False)
+    # Cast to the registry dtypes and save the DimProfession DataFrame to a CSV file
+    professions_df = cast_frame(professions_df, 'DimProfession')
+    write_star_csv(professions_df, 'DimProfession', os.path.join(save_path, 'DimProfession.csv'))
     
+    record_rows(stage, rows_out=len(professions_df))
     return professions_df
 
 
-def create_bridge_movie_principals(principals_csv_path, save_path):
+def create_bridge_movie_principals(principals_csv_path, save_path, stage=None):
     # Load the principals data
     principals_df = pd.read_csv(principals_csv_path)
+    record_rows(stage, rows_in=len(principals_df))
     
     # Rename the columns to match the star schema and align with the Dimension tables
     principals_df.rename(columns={'tconst': 'movieId', 'nconst': 'personId', 
                                   'professionId': 'professionId', 'principalId': 'principalId'}, inplace=True)
 
-    # Replace '\\N' with the string 'NULL' for columns that need it
-    principals_df['job'].replace('\\N', 'NULL', inplace=True)
-    principals_df['characters'].replace('\\N', 'NULL', inplace=True)
-
-    # Save the Bridge_MoviePrincipals DataFrame to a CSV file
-    principals_df.to_csv(os.path.join(save_path, 'Bridge_MoviePrincipals.csv'), index=False)
+    # Cast to the registry dtypes and save the Bridge_MoviePrincipals DataFrame to a CSV file
+    principals_df = cast_frame(principals_df, 'Bridge_MoviePrincipals')
+    write_star_csv(principals_df, 'Bridge_MoviePrincipals', os.path.join(save_path, 'Bridge_MoviePrincipals.csv'))
     
+    record_rows(stage, rows_out=len(principals_df))
     return principals_df
 
 
-def create_bridge_principal_professions(name_professions_csv_path, save_path):
+def create_bridge_principal_professions(name_professions_csv_path, save_path, stage=None):
     # Load the name-professions relationship data
     name_professions_df = pd.read_csv(name_professions_csv_path)
+    record_rows(stage, rows_in=len(name_professions_df))
     
     # Rename the columns to match the star schema and align with the Dimension tables
     name_professions_df.rename(columns={'nconst': 'personId', 'professionId': 'professionId'}, inplace=True)
     
-    # Save the Bridge_PrincipalProfessions DataFrame to a CSV file
-    name_professions_df.to_csv(os.path.join(save_path, 'Bridge_PrincipalProfessions.csv'), index=False)
+    # Cast to the registry dtypes and save the Bridge_PrincipalProfessions DataFrame to a CSV file
+    name_professions_df = cast_frame(name_professions_df, 'Bridge_PrincipalProfessions')
+    write_star_csv(name_professions_df, 'Bridge_PrincipalProfessions', os.path.join(save_path, 'Bridge_PrincipalProfessions.csv'))
     
+    record_rows(stage, rows_out=len(name_professions_df))
     return name_professions_df
 
 
-def create_dim_date(movies_csv_path, save_path, year_extension=5):
+def create_dim_date(movies_csv_path, save_path, year_extension=5, stage=None):
     # Load the movies data
     movies_df = pd.read_csv(movies_csv_path)
+    record_rows(stage, rows_in=len(movies_df))
 
     # Find the minimum and maximum years from the startYear column
     # Assuming missing or malformed years are handled or filtered out
@@ -129,15 +144,18 @@ def create_dim_date(movies_csv_path, save_path, year_extension=5):
     dim_date = pd.DataFrame(years, columns=['year'])
     dim_date['dateKey'] = dim_date['year']
     
-    # Save the DimDate DataFrame to a CSV file
-    dim_date.to_csv(os.path.join(save_path, 'DimDate.csv'), index=False)
+    # Cast to the registry dtypes and save the DimDate DataFrame to a CSV file
+    dim_date = cast_frame(dim_date, 'DimDate')
+    write_star_csv(dim_date, 'DimDate', os.path.join(save_path, 'DimDate.csv'))
     
+    record_rows(stage, rows_out=len(dim_date))
     return dim_date
 
 
-def create_fact_movie_data(movies_csv_path, save_path):
+def create_fact_movie_data(movies_csv_path, save_path, stage=None):
     # Load the movies data
     movies_df = pd.read_csv(movies_csv_path)
+    record_rows(stage, rows_in=len(movies_df))
 
     # Create the Fact_MovieData DataFrame
     fact_movie_data = movies_df[['tconst', 'startYear', 'averageRating', 'numVotes']].copy()
@@ -146,24 +164,71 @@ def create_fact_movie_data(movies_csv_path, save_path):
     # Optionally, generate a unique ID for each fact record
     fact_movie_data['factId'] = range(1, len(fact_movie_data) + 1)
     
-    # Save the Fact_MovieData DataFrame to a CSV file
-    fact_movie_data.to_csv(os.path.join(save_path, 'Fact_MovieData.csv'), index=False)
+    # Cast to the registry dtypes and save the Fact_MovieData DataFrame to a CSV file
+    fact_movie_data = cast_frame(fact_movie_data, 'Fact_MovieData')
+    write_star_csv(fact_movie_data, 'Fact_MovieData', os.path.join(save_path, 'Fact_MovieData.csv'))
     
+    record_rows(stage, rows_out=len(fact_movie_data))
     return fact_movie_data
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Transform the IMDb source CSV files into the star schema CSV files.')
+    parser.add_argument('--delta', action='store_true',
+                        help='Also write per-table inserted/updated/deleted rows of the validated tables against the last loaded snapshot.')
+    args = parser.parse_args()
+
     # csv orig_folder and saved_folder
     orig_folder = '../../../IMDB_top250/datasets_top250/'
     saved_folder = '../datasets_star/'
+    validated_folder = '../datasets_validated/'
+    quarantine_folder = '../datasets_quarantine/'
     os.makedirs(saved_folder, exist_ok=True)
 
-    create_dim_movie(orig_folder + 'movies.csv', saved_folder)
-    create_dim_genre(orig_folder + 'genres.csv', saved_folder)
-    create_bridge_movie_genres(orig_folder + 'movie_genres.csv', saved_folder)
-    create_dim_person(orig_folder + 'names.csv', saved_folder)
-    create_dim_profession(orig_folder + 'professions.csv', saved_folder)
-    create_bridge_movie_principals(orig_folder + 'principals.csv', saved_folder)
-    create_bridge_principal_professions(orig_folder + 'name_professions.csv', saved_folder)
-    create_dim_date(orig_folder + 'movies.csv', saved_folder)
-    create_fact_movie_data(orig_folder + 'movies.csv', saved_folder)
\ No newline at end of file
+    # (stage name, ETL function, source CSV) in the order the tables are created
+    stages = [
+        ('DimMovie', create_dim_movie, 'movies.csv'),
+        ('DimGenre', create_dim_genre, 'genres.csv'),
+        ('Bridge_MovieGenres', create_bridge_movie_genres, 'movie_genres.csv'),
+        ('DimPerson', create_dim_person, 'names.csv'),
+        ('DimProfession', create_dim_profession, 'professions.csv'),
+        ('Bridge_MoviePrincipals', create_bridge_movie_principals, 'principals.csv'),
+        ('Bridge_PrincipalProfessions', create_bridge_principal_professions, 'name_professions.csv'),
+        ('DimDate', create_dim_date, 'movies.csv'),
+        ('Fact_MovieData', create_fact_movie_data, 'movies.csv'),
+    ]
+
+    run = start_run('create_csv_tables')
+    try:
+        for table, create_function, source_csv in stages:
+            with track_stage(run, table, output_path=os.path.join(saved_folder, table + '.csv')) as stage:
+                create_function(orig_folder + source_csv, saved_folder, stage=stage)
+
+        # The loader reads the validated tables, so deltas must be taken from them too,
+        # otherwise quarantined rows would come back as inserts and skip validation
+        with track_stage(run, 'validation') as stage:
+            validate_star(saved_folder, validated_folder, quarantine_folder, stage=stage)
+
+        # Rebuild the indexes from the validated tables, so they never lag the data;
+        # the fact -> movie and person -> movie links are built once and shared by both indexes
+        links_path = '../star_index/links.npz'
+        with track_stage(run, 'star_links', output_path=links_path) as stage:
+            tables = load_star_tables(validated_folder)
+            links = build_links_index(tables, links_path)
+            record_rows(stage, rows_out=len(links['fact_movie_ordinals']))
+
+        with track_stage(run, 'bitmap_indexes') as stage:
+            indexes = build_star_indexes(tables)
+            record_rows(stage, rows_out=sum(len(index['names']) for index in indexes.values()))
+
+        # Precompute the collaboration graph, so queries never self-join Bridge_MoviePrincipals
+        graph_path = '../graph_index/collaboration.npz'
+        with track_stage(run, 'collaboration_graph', output_path=graph_path) as stage:
+            graph = build_graph_index(tables, links, graph_path)
+            record_rows(stage, rows_in=int(graph['person_movie_indptr'][-1]), rows_out=len(graph['collab_indices']))
+
+        if args.delta:
+            with track_stage(run, 'delta_detection'):
+                write_star_deltas(validated_folder)
+    finally:
+        finish_run(run)
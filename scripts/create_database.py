@@ -1,7 +1,15 @@
 import os
+import re
+import hashlib
+import argparse
 import pyodbc
 import pandas as pd
-from utils import db_config, CONN_STRING
+from utils import db_config, CONN_STRING, dim_table_map, aggregate_table_map, fact_measures
+from etl_metrics import start_run, finish_run, track_stage, record_rows
+from delta_etl import DELETE, promote_snapshot, write_snapshot
+from star_schema import star_table_names, star_table_keys, star_surrogate_keys, column_names, create_table_ddl, read_star_csv, to_sql_rows, sql_payload_bytes
+from create_datacube import build_dynamic_query
+from cube_cache import clear_cube_cache
 
 
 def create_database(db_config):
@@ -11,12 +19,20 @@ def create_database(db_config):
     conn = pyodbc.connect(conn_string, autocommit=True)
     cursor = conn.cursor()
 
-    # SQL query to create the new database
-    create_db_query = f"IF NOT EXISTS (SELECT * FROM sys.databases WHERE name = N'{db_config['database']}') BEGIN CREATE DATABASE [{db_config['database']}] END"
+    # SQL query to create the new database; the name is bound as a parameter and
+    # quoted server-side because identifiers cannot be placeholders in DDL
+    create_db_query = """
+    DECLARE @name SYSNAME = ?;
+    IF NOT EXISTS (SELECT * FROM sys.databases WHERE name = @name)
+    BEGIN
+        DECLARE @sql NVARCHAR(MAX) = N'CREATE DATABASE ' + QUOTENAME(@name);
+        EXEC(@sql);
+    END
+    """
 
     # Execute the query to create the database
     try:
-        cursor.execute(create_db_query)
+        cursor.execute(create_db_query, db_config['database'])
         print(f"Database '{db_config['database']}' created successfully.")
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -34,14 +50,17 @@ def drop_database(db_config):
     conn.autocommit = True
     cursor = conn.cursor()
 
-    # SQL queries to set the database to single user mode and drop it
-    set_single_user_query = f"ALTER DATABASE [{db_config['database']}] SET SINGLE_USER WITH ROLLBACK IMMEDIATE"
-    drop_db_query = f"DROP DATABASE [{db_config['database']}]"
+    # SQL query to set the database to single user mode and drop it, with the name bound as a parameter
+    drop_db_query = """
+    DECLARE @name SYSNAME = ?;
+    DECLARE @sql NVARCHAR(MAX) = N'ALTER DATABASE ' + QUOTENAME(@name) + N' SET SINGLE_USER WITH ROLLBACK IMMEDIATE; '
+                               + N'DROP DATABASE ' + QUOTENAME(@name);
+    EXEC(@sql);
+    """
 
-    # Execute the queries to set to single user mode and drop the database
+    # Execute the query to set to single user mode and drop the database
     try:
-        cursor.execute(set_single_user_query)
-        cursor.execute(drop_db_query)
+        cursor.execute(drop_db_query, db_config['database'])
         print(f"Database '{db_config['database']}' dropped successfully.")
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -50,304 +69,282 @@ def drop_database(db_config):
         conn.close()
 
 
-def create_and_import_dim_movie(csv_path):    
-    # SQL query to create the DimMovie table with an additional column for runtimeMinutes
-    create_table_query = """
-    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[DimMovie]') AND type in (N'U'))
-    CREATE TABLE DimMovie (
-        movieId VARCHAR(255) PRIMARY KEY,
-        titleType VARCHAR(255),
-        primaryTitle VARCHAR(255),
-        originalTitle VARCHAR(255),
-        isAdult BIT,
-        startYear INT,
-        endYear INT NULL,
-        runtimeMinutes INT NULL
-    )
-    """
+# Rows committed per transaction during table loads
+LOAD_CHUNK_SIZE = 10000
 
-    # Connect to the database
-    with pyodbc.connect(CONN_STRING) as conn:
-        cursor = conn.cursor()
-        # Create DimMovie table
-        cursor.execute(create_table_query)
-        print("DimMovie table created successfully.")
-
-        # Import data from CSV to DimMovie table
-        movies_df = pd.read_csv(csv_path)
-
-        # Convert 'isAdult' to boolean (True/False)
-        movies_df['isAdult'] = movies_df['isAdult'].apply(lambda x: True if x == 'True' else False)
-
-        # Convert 'startYear', 'endYear', and 'runtimeMinutes' to integers or None
-        movies_df['startYear'] = movies_df['startYear'].apply(lambda x: int(x) if pd.notnull(x) else None)
-        movies_df['endYear'] = movies_df['endYear'].apply(lambda x: int(x) if pd.notnull(x) else None)
-        movies_df['runtimeMinutes'] = movies_df['runtimeMinutes'].apply(lambda x: int(x) if pd.notnull(x) else None)
-
-        # Replace NaN with None for SQL compatibility
-        movies_df = movies_df.where(pd.notnull(movies_df), None)
-        
-        for index, row in movies_df.iterrows():
-            cursor.execute("INSERT INTO DimMovie (movieId, titleType, primaryTitle, originalTitle, isAdult, startYear, endYear, runtimeMinutes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", 
-                           row['movieId'], row['titleType'], row['primaryTitle'], row['originalTitle'], row['isAdult'], row['startYear'], row['endYear'], row['runtimeMinutes'])
-        print("Data imported into DimMovie table successfully.")
-
-
-def create_and_import_dim_genre(csv_path):
-    # SQL query to create the DimGenre table
-    create_table_query = """
-    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[DimGenre]') AND type in (N'U'))
-    CREATE TABLE DimGenre (
-        genreId INT PRIMARY KEY,
-        genreName VARCHAR(255)
-    )
-    """
 
-    # Connect to the database
-    with pyodbc.connect(CONN_STRING) as conn:
-        cursor = conn.cursor()
-        # Create DimGenre table
-        cursor.execute(create_table_query)
-        print("DimGenre table created successfully.")
-
-        # Import data from CSV to DimGenre table
-        genres_df = pd.read_csv(csv_path)
-        for index, row in genres_df.iterrows():
-            cursor.execute("INSERT INTO DimGenre (genreId, genreName) VALUES (?, ?)", 
-                           row['genreId'], row['genreName'])
-        print("Data imported into DimGenre table successfully.")
-
-
-def create_and_import_dim_date(csv_path):
-    # SQL query to create the DimDate table
-    create_table_query = """
-    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[DimDate]') AND type in (N'U'))
-    CREATE TABLE DimDate (
-        year INT,
-        dateKey INT PRIMARY KEY
-    )
-    """
+def source_fingerprint(csv_path):
+    # Content hash of the CSV, so a checkpoint is only resumed against the same file
+    digest = hashlib.sha1()
+    with open(csv_path, 'rb') as csv_file:
+        for block in iter(lambda: csv_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-    # Connect to the database
-    with pyodbc.connect(CONN_STRING) as conn:
-        cursor = conn.cursor()
 
-        # Create DimDate table
-        cursor.execute(create_table_query)
-        print("DimDate table created successfully.")
-
-        # Import data from CSV to DimDate table
-        dates_df = pd.read_csv(csv_path)
-        for index, row in dates_df.iterrows():
-            # Convert numpy.int64 to native Python int
-            year = int(row['year']) if pd.notnull(row['year']) else None
-            dateKey = int(row['dateKey']) if pd.notnull(row['dateKey']) else None
-            cursor.execute("INSERT INTO DimDate (year, dateKey) VALUES (?, ?)", year, dateKey)
-        print("Data imported into DimDate table successfully.")
-
-
-def create_and_import_dim_person(csv_path):
-    # SQL query to create the DimPerson table
-    create_table_query = """
-    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[DimPerson]') AND type in (N'U'))
-    CREATE TABLE DimPerson (
-        personId VARCHAR(255) PRIMARY KEY,
-        name VARCHAR(255),
-        birthYear INT NULL,
-        deathYear INT NULL
+def read_load_checkpoint(cursor, table):
+    # The checkpoint table lives in the loaded database, so it commits atomically with each chunk
+    cursor.execute("""
+    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[etl_LoadCheckpoint]') AND type in (N'U'))
+    CREATE TABLE etl_LoadCheckpoint (
+        tableName VARCHAR(255) PRIMARY KEY,
+        sourceFingerprint VARCHAR(64),
+        rowsCommitted INT,
+        updatedAt DATETIME2
     )
-    """
+    """)
+    cursor.execute("SELECT sourceFingerprint, rowsCommitted FROM etl_LoadCheckpoint WHERE tableName = ?", table)
+    return cursor.fetchone()
 
-    # Connect to the database
-    with pyodbc.connect(CONN_STRING) as conn:
-        cursor = conn.cursor()
 
-        # Create DimPerson table
-        cursor.execute(create_table_query)
-        print("DimPerson table created successfully.")
-
-        # Import data from CSV to DimPerson table
-        persons_df = pd.read_csv(csv_path)
-        # Handle NULL values for birthYear and deathYear
-        for index, row in persons_df.iterrows():
-            birthYear = int(row['birthYear']) if pd.notnull(row['birthYear']) else None
-            deathYear = int(row['deathYear']) if pd.notnull(row['deathYear']) else None
-
-            cursor.execute("INSERT INTO DimPerson (personId, name, birthYear, deathYear) VALUES (?, ?, ?, ?)", 
-                           row['personId'], row['name'], birthYear, deathYear)
-        print("Data imported into DimPerson table successfully.")
-
-
-def create_and_import_dim_profession(csv_path):
-    # SQL query to create the DimProfession table
-    create_table_query = """
-    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[DimProfession]') AND type in (N'U'))
-    CREATE TABLE DimProfession (
-        professionId INT PRIMARY KEY,
-        profession VARCHAR(255)
-    )
-    """
+def write_load_checkpoint(cursor, table, fingerprint, rows_committed):
+    cursor.execute("""
+    MERGE etl_LoadCheckpoint AS target
+    USING (SELECT ? AS tableName, ? AS sourceFingerprint, ? AS rowsCommitted) AS source
+    ON target.tableName = source.tableName
+    WHEN MATCHED THEN UPDATE SET sourceFingerprint = source.sourceFingerprint, rowsCommitted = source.rowsCommitted, updatedAt = SYSUTCDATETIME()
+    WHEN NOT MATCHED THEN INSERT (tableName, sourceFingerprint, rowsCommitted, updatedAt)
+        VALUES (source.tableName, source.sourceFingerprint, source.rowsCommitted, SYSUTCDATETIME());
+    """, table, fingerprint, rows_committed)
+
 
+def load_rows_in_chunks(conn, table, table_df, csv_path, chunk_size=LOAD_CHUNK_SIZE):
+    # Insert rows chunk by chunk, each chunk and its checkpoint in one transaction,
+    # resuming after the last committed chunk of an earlier, interrupted run
+    cursor = conn.cursor()
+    fingerprint = source_fingerprint(csv_path)
+    checkpoint = read_load_checkpoint(cursor, table)
+    conn.commit()
+
+    start = 0
+    if checkpoint is not None:
+        if checkpoint.sourceFingerprint != fingerprint:
+            raise RuntimeError(f"{table} was loaded from a different version of {csv_path}. "
+                               f"Apply the change with --delta, or drop the database to reload it.")
+        start = checkpoint.rowsCommitted
+        if start:
+            print(f"Resuming {table} load after {start} committed rows.")
+
+    columns = column_names(table)
+    insert_query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    cursor.fast_executemany = True
+    bytes_sent = 0
+    for chunk_start in range(start, len(table_df), chunk_size):
+        chunk_end = min(chunk_start + chunk_size, len(table_df))
+        chunk_df = table_df.iloc[chunk_start:chunk_end]
+        try:
+            # Typed columns are converted to pyodbc values one chunk at a time
+            cursor.executemany(insert_query, to_sql_rows(chunk_df, table))
+            write_load_checkpoint(cursor, table, fingerprint, chunk_end)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            print(f"{table} load failed in rows {chunk_start + 1}-{chunk_end}; the next run resumes from row {chunk_start + 1}.")
+            raise
+        # Only chunks committed in this run count, not the rows an earlier run already loaded
+        bytes_sent += sql_payload_bytes(chunk_df, table)
+
+    # Record the checkpoint of an empty source as well, so reruns see it as loaded
+    if checkpoint is None and table_df.empty:
+        write_load_checkpoint(cursor, table, fingerprint, 0)
+        conn.commit()
+    return max(len(table_df) - start, 0), bytes_sent
+
+
+def create_and_import_table(table, csv_path, stage=None, chunk_size=LOAD_CHUNK_SIZE):
     # Connect to the database
     with pyodbc.connect(CONN_STRING) as conn:
         cursor = conn.cursor()
 
-        # Create DimProfession table
-        cursor.execute(create_table_query)
-        print("DimProfession table created successfully.")
-
-        # Import data from CSV to DimProfession table
-        professions_df = pd.read_csv(csv_path)
-        for index, row in professions_df.iterrows():
-            cursor.execute("INSERT INTO DimProfession (professionId, profession) VALUES (?, ?)", 
-                           row['professionId'], row['profession'])
-        print("Data imported into DimProfession table successfully.")
-
-
-
-def create_and_import_bridge_movie_genres(csv_path):
-    # SQL query to create the Bridge_MovieGenres table
-    create_table_query = """
-    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[Bridge_MovieGenres]') AND type in (N'U'))
-    CREATE TABLE Bridge_MovieGenres (
-        movieId VARCHAR(255),
-        genreId INT,
-        PRIMARY KEY (movieId, genreId),
-        FOREIGN KEY (movieId) REFERENCES DimMovie(movieId),
-        FOREIGN KEY (genreId) REFERENCES DimGenre(genreId)
-    )
+        # Create the table from its schema registry definition
+        cursor.execute(create_table_ddl(table))
+        conn.commit()
+        print(f"{table} table created successfully.")
+
+        # Import data from CSV, parsed straight into the registry dtypes
+        table_df = read_star_csv(table, csv_path)
+        record_rows(stage, rows_in=len(table_df))
+
+        inserted, bytes_sent = load_rows_in_chunks(conn, table, table_df, csv_path, chunk_size)
+        record_rows(stage, rows_out=inserted, bytes_written=bytes_sent)
+        print(f"Data imported into {table} table successfully.")
+
+
+def build_merge_statement(table, columns, staging_table):
+    keys = star_table_keys[table]
+    surrogate_key = star_surrogate_keys.get(table)
+    value_columns = [column for column in columns if column not in keys and column != surrogate_key]
+    insert_columns = [column for column in columns if column != surrogate_key]
+
+    # Surrogate keys continue after the current maximum instead of using the CSV numbering
+    if surrogate_key:
+        source = (f"(SELECT staged.*, base.maxId + ROW_NUMBER() OVER (ORDER BY {', '.join(f'staged.{key}' for key in keys)}) AS newSurrogateKey "
+                  f"FROM {staging_table} staged CROSS JOIN (SELECT ISNULL(MAX({surrogate_key}), 0) AS maxId FROM {table}) base)")
+        insert_clause = (f"INSERT ({', '.join(insert_columns + [surrogate_key])}) "
+                         f"VALUES ({', '.join(f'source.{column}' for column in insert_columns)}, source.newSurrogateKey)")
+    else:
+        source = staging_table
+        insert_clause = f"INSERT ({', '.join(insert_columns)}) VALUES ({', '.join(f'source.{column}' for column in insert_columns)})"
+
+    merge_query = f"""
+    MERGE {table} WITH (HOLDLOCK) AS target
+    USING {source} AS source
+    ON {' AND '.join(f'target.{key} = source.{key}' for key in keys)}
+    WHEN MATCHED AND source.changeType = 'D' THEN DELETE
     """
-
-    # Connect to the database
-    with pyodbc.connect(CONN_STRING) as conn:
-        cursor = conn.cursor()
-        
-        # Create Bridge_MovieGenres table
-        cursor.execute(create_table_query)
-        print("Bridge_MovieGenres table created successfully.")
-
-        # Import data from CSV to Bridge_MovieGenres table
-        bridge_df = pd.read_csv(csv_path)
-        for index, row in bridge_df.iterrows():
-            cursor.execute("INSERT INTO Bridge_MovieGenres (movieId, genreId) VALUES (?, ?)", 
-                           row['movieId'], row['genreId'])
-        print("Data imported into Bridge_MovieGenres table successfully.")
-
-
-def create_and_import_bridge_movie_principals(csv_path):
-    # SQL query to create the Bridge_MoviePrincipals table
-    create_table_query = """
-    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[Bridge_MoviePrincipals]') AND type in (N'U'))
-    CREATE TABLE Bridge_MoviePrincipals (
-        principalId INT PRIMARY KEY,
-        movieId VARCHAR(255),
-        ordering INT,
-        personId VARCHAR(255),
-        job VARCHAR(255),
-        characters VARCHAR(255),
-        professionId INT,
-        FOREIGN KEY (movieId) REFERENCES DimMovie(movieId),
-        FOREIGN KEY (personId) REFERENCES DimPerson(personId),
-        FOREIGN KEY (professionId) REFERENCES DimProfession(professionId)
-    )
+    if value_columns:
+        merge_query += f"""WHEN MATCHED AND source.changeType <> 'D' THEN UPDATE SET {', '.join(f'target.{column} = source.{column}' for column in value_columns)}
     """
+    merge_query += f"""WHEN NOT MATCHED BY TARGET AND source.changeType <> 'D' THEN {insert_clause};"""
+    return merge_query
 
-    # Connect to the database
-    with pyodbc.connect(CONN_STRING) as conn:
-        cursor = conn.cursor()
 
-        # Create Bridge_MoviePrincipals table
-        cursor.execute(create_table_query)
-        print("Bridge_MoviePrincipals table created successfully.")
-
-        # Import data from CSV to Bridge_MoviePrincipals table
-        bridge_df = pd.read_csv(csv_path)
-        for index, row in bridge_df.iterrows():
-            # Convert to int, handling NULL values
-            ordering = int(row['ordering']) if pd.notnull(row['ordering']) else None
-            professionId = int(row['professionId']) if pd.notnull(row['professionId']) else None
-
-            # Convert to string, handling NULL values
-            job = str(row['job']) if pd.notnull(row['job']) else None
-            characters = str(row['characters']) if pd.notnull(row['characters']) else None
-            cursor.execute("INSERT INTO Bridge_MoviePrincipals (principalId, movieId, ordering, personId, job, characters, professionId) VALUES (?, ?, ?, ?, ?, ?, ?)", 
-                           row['principalId'], row['movieId'], ordering, row['personId'], job, characters, professionId)
-        print("Data imported into Bridge_MoviePrincipals table successfully.")
-
-
-def create_and_import_bridge_principal_professions(csv_path):
-    # SQL query to create the Bridge_PrincipalProfessions table
-    create_table_query = """
-    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[Bridge_PrincipalProfessions]') AND type in (N'U'))
-    CREATE TABLE Bridge_PrincipalProfessions (
-        personId VARCHAR(255),
-        professionId INT,
-        PRIMARY KEY (personId, professionId),
-        FOREIGN KEY (personId) REFERENCES DimPerson(personId),
-        FOREIGN KEY (professionId) REFERENCES DimProfession(professionId)
-    )
-    """
+def apply_table_delta(cursor, table, delta_df):
+    # Stage the delta rows as text and let one set-based MERGE convert and apply them
+    staging_table = f'#delta_{table}'
+    columns = [column for column in delta_df.columns if column != 'changeType']
+    cursor.execute(f"IF OBJECT_ID('tempdb..{staging_table}') IS NOT NULL DROP TABLE {staging_table}")
+    cursor.execute(f"CREATE TABLE {staging_table} ({', '.join(f'{column} NVARCHAR(4000) NULL' for column in columns)}, changeType CHAR(1) NOT NULL)")
 
-    # Connect to the database
+    # 'NULL' placeholders and the empty values of delete rows become SQL NULLs
+    rows = delta_df[columns + ['changeType']].replace({'NULL': None, '': None}).values.tolist()
+    cursor.fast_executemany = True
+    cursor.executemany(f"INSERT INTO {staging_table} ({', '.join(columns)}, changeType) VALUES ({', '.join('?' for _ in columns)}, ?)", rows)
+
+    cursor.execute(build_merge_statement(table, columns, staging_table))
+    cursor.execute(f"DROP TABLE {staging_table}")
+
+
+def read_star_deltas(delta_folder='../datasets_delta/'):
+    # Read the pending deltas written by create_csv_tables.py --delta
+    deltas = {}
+    for table in star_table_names:
+        delta_path = os.path.join(delta_folder, table + '.csv')
+        if os.path.exists(delta_path):
+            deltas[table] = pd.read_csv(delta_path, dtype=str, keep_default_na=False)
+    return deltas
+
+
+def apply_star_deltas(deltas, delta_folder='../datasets_delta/', snapshot_folder='../datasets_snapshot/', run=None):
     with pyodbc.connect(CONN_STRING) as conn:
         cursor = conn.cursor()
 
-        # Create Bridge_PrincipalProfessions table
-        cursor.execute(create_table_query)
-        print("Bridge_PrincipalProfessions table created successfully.")
-
-        # Import data from CSV to Bridge_PrincipalProfessions table
-        bridge_df = pd.read_csv(csv_path)
-        for index, row in bridge_df.iterrows():
-            cursor.execute("INSERT INTO Bridge_PrincipalProfessions (personId, professionId) VALUES (?, ?)", 
-                           row['personId'], row['professionId'])
-        print("Data imported into Bridge_PrincipalProfessions table successfully.")
-
-
-def create_and_import_fact_movie_data(csv_path):
-    # SQL query to create the Fact_MovieData table
-    create_table_query = """
-    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[Fact_MovieData]') AND type in (N'U'))
-    CREATE TABLE Fact_MovieData (
-        factId INT PRIMARY KEY,
-        movieId VARCHAR(255),
-        dateKey INT,
-        averageRating FLOAT,
-        numVotes INT,
-        FOREIGN KEY (movieId) REFERENCES DimMovie(movieId),
-        FOREIGN KEY (dateKey) REFERENCES DimDate(dateKey)
-    )
-    """
+        # Deletes run children first, inserts and updates parents first, so foreign keys hold throughout
+        for table in reversed(star_table_names):
+            if table in deltas:
+                delete_df = deltas[table][deltas[table]['changeType'] == DELETE]
+                if len(delete_df):
+                    apply_table_delta(cursor, table, delete_df)
 
-    # Connect to the database
+        for table in star_table_names:
+            if table in deltas:
+                with track_stage(run, f'{table}_delta') as stage:
+                    upsert_df = deltas[table][deltas[table]['changeType'] != DELETE]
+                    if len(upsert_df):
+                        apply_table_delta(cursor, table, upsert_df)
+                    record_rows(stage, rows_in=len(deltas[table]), rows_out=len(deltas[table]))
+
+        # One transaction for the whole refresh; snapshots advance only after it commits
+        conn.commit()
+
+    for table in deltas:
+        promote_snapshot(table, delta_folder, snapshot_folder)
+    print(f"Applied deltas for {len(deltas)} tables.")
+
+
+def aggregate_source_tables(aggregate_dims):
+    # Every star table the summary query reads: the fact table plus each dimension's join path
+    tables = {'Fact_MovieData'}
+    for dim in aggregate_dims:
+        tables.add(dim_table_map[dim][0])
+        tables.update(re.findall(r'(\w+)\.', ' '.join(dim_table_map[dim])))
+    return tables
+
+
+def stale_aggregate_tables(changed_tables):
+    # Summary tables reading a changed star table, plus any an earlier failed run left unrefreshed
     with pyodbc.connect(CONN_STRING) as conn:
         cursor = conn.cursor()
+        refreshed = set()
+        if cursor.execute("SELECT OBJECT_ID(N'[dbo].[etl_AggregateRefresh]', N'U')").fetchone()[0] is not None:
+            refreshed = {row.tableName for row in cursor.execute("SELECT tableName FROM etl_AggregateRefresh").fetchall()}
+    return [aggregate_table for aggregate_table, aggregate_dims in aggregate_table_map.items()
+            if aggregate_table not in refreshed or aggregate_source_tables(aggregate_dims) & set(changed_tables)]
 
-        # Create Fact_MovieData table
-        cursor.execute(create_table_query)
-        print("Fact_MovieData table created successfully.")
 
-        # Import data from CSV to Fact_MovieData table
-        facts_df = pd.read_csv(csv_path)
-        for index, row in facts_df.iterrows():
-            cursor.execute("INSERT INTO Fact_MovieData (factId, movieId, dateKey, averageRating, numVotes) VALUES (?, ?, ?, ?, ?)", 
-                           row['factId'], row['movieId'], row['dateKey'], row['averageRating'], row['numVotes'])
-        print("Data imported into Fact_MovieData table successfully.")
+def invalidate_aggregate_tables(aggregate_tables):
+    # Called before the base star changes: until a table is rebuilt and logged
+    # again, cube queries skip it and read the base star instead
+    with pyodbc.connect(CONN_STRING) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+        IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[etl_AggregateRefresh]') AND type in (N'U'))
+        CREATE TABLE etl_AggregateRefresh (
+            tableName VARCHAR(255) PRIMARY KEY,
+            refreshedAt DATETIME2
+        )
+        """)
+        if aggregate_tables:
+            cursor.execute(f"DELETE FROM etl_AggregateRefresh WHERE tableName IN ({', '.join('?' for _ in aggregate_tables)})", *aggregate_tables)
+        conn.commit()
+
+
+def refresh_aggregate_tables(aggregate_tables, run=None):
+    # Rebuild the given summary tables from the base star after a load, so the
+    # cube queries routed to them never see stale sums
+    with pyodbc.connect(CONN_STRING) as conn:
+        cursor = conn.cursor()
+        for aggregate_table in aggregate_tables:
+            aggregate_dims = aggregate_table_map[aggregate_table]
+            with track_stage(run, aggregate_table) as stage:
+                state_query, _ = build_dynamic_query(fact_measures, aggregate_dims, state=True, use_aggregates=False)
+                # Drop, rebuild and index in one transaction; readers wait instead of seeing an empty table
+                cursor.execute(f"IF OBJECT_ID(N'[dbo].[{aggregate_table}]', N'U') IS NOT NULL DROP TABLE {aggregate_table}")
+                cursor.execute(f"SELECT * INTO {aggregate_table} FROM ({state_query}) AS state")
+                cursor.execute(f"CREATE CLUSTERED INDEX IX_{aggregate_table} ON {aggregate_table} ({', '.join(aggregate_dims)})")
+                # Logged in the same transaction, so only a complete rebuild is routed to
+                cursor.execute("INSERT INTO etl_AggregateRefresh (tableName, refreshedAt) VALUES (?, SYSDATETIME())", aggregate_table)
+                conn.commit()
+                rows = cursor.execute(f"SELECT COUNT(*) FROM {aggregate_table}").fetchone()[0]
+                record_rows(stage, rows_out=rows)
+                print(f"{aggregate_table} refreshed with {rows} rows.")
 
 
 if __name__ == "__main__":
-    # csv data folder
-    data_folder = '../datasets_star/'
-
-    create_database(db_config)
-    create_and_import_dim_movie(data_folder + 'DimMovie.csv')
-    create_and_import_dim_genre(data_folder + 'DimGenre.csv')
-    create_and_import_dim_date(data_folder + 'DimDate.csv')
-    create_and_import_dim_person(data_folder + 'DimPerson.csv')
-    create_and_import_dim_profession(data_folder + 'DimProfession.csv')
-    create_and_import_bridge_movie_genres(data_folder + 'Bridge_MovieGenres.csv')
-    create_and_import_bridge_movie_principals(data_folder + 'Bridge_MoviePrincipals.csv')
-    create_and_import_bridge_principal_professions(data_folder + 'Bridge_PrincipalProfessions.csv')
-    create_and_import_fact_movie_data(data_folder + 'Fact_MovieData.csv')
-
-    # drop_database(db_config)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Create the movie database and load the star schema CSV files.')
+    parser.add_argument('--data', default='../datasets_validated/',
+                        help='Specify the folder holding the validated star schema CSV files written by validate_star.py. '
+                             'Default is "../datasets_validated/".')
+    parser.add_argument('--chunk-size', type=int, default=LOAD_CHUNK_SIZE,
+                        help=f'Rows committed per transaction during a full load. Default is {LOAD_CHUNK_SIZE}.')
+    parser.add_argument('--delta', action='store_true',
+                        help='Apply the pending deltas from create_csv_tables.py --delta with MERGE instead of a full load.')
+    args = parser.parse_args()
+
+    run = start_run('create_database')
+    try:
+        if args.delta:
+            # Only the summary tables reading a changed star table are rebuilt
+            deltas = read_star_deltas()
+            aggregate_tables = stale_aggregate_tables([table for table, delta_df in deltas.items() if len(delta_df)])
+            invalidate_aggregate_tables(aggregate_tables)
+            apply_star_deltas(deltas, run=run)
+        else:
+            with track_stage(run, 'create_database'):
+                create_database(db_config)
+            aggregate_tables = list(aggregate_table_map)
+            invalidate_aggregate_tables(aggregate_tables)
+            # star_table_names is in foreign key dependency order
+            for table in star_table_names:
+                with track_stage(run, table) as stage:
+                    create_and_import_table(table, os.path.join(args.data, table + '.csv'), stage=stage, chunk_size=args.chunk_size)
+                # Later --delta runs compare against what was loaded here
+                write_snapshot(table, args.data)
+        # Both load paths leave the summary tables in step with the base star
+        refresh_aggregate_tables(aggregate_tables, run=run)
+    finally:
+        # Even a failed load may have changed the tables, so no cached cube survives it
+        clear_cube_cache()
+        finish_run(run)
+
+    # drop_database(db_config)
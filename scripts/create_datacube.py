@@ -1,22 +1,157 @@
-import os
+import re
 import sys
 import argparse
 import warnings
-from utils import dim_table_map, execute_sql_query
+from utils import dim_table_map, dim_hierarchies, aggregate_table_map, execute_sql_query, get_ready_aggregate_tables
+from result_writers import output_formats, write_result
 
 
 # Filter out UserWarning category warnings
 warnings.filterwarnings('ignore', category=UserWarning)
 
 
-def build_dynamic_query(selected_measures, selected_dims):
+# Comparison operators accepted in filters; values are always bound as parameters
+filter_operators = ['=', '<>', '<', '<=', '>', '>=']
+
+
+def add_dim_joins(dim, join_clauses):
+    table, join_condition, dim_type, *bridge_info = dim_table_map[dim]
+    if dim_type == 'secondary' and bridge_info:
+        bridge_table, bridge_condition = bridge_info[:2]
+        # Bridge_PrincipalProfessions is reached through Bridge_MoviePrincipals
+        if bridge_table == 'Bridge_PrincipalProfessions':
+            add_join('JOIN Bridge_MoviePrincipals ON Fact_MovieData.movieId = Bridge_MoviePrincipals.movieId', join_clauses)
+        add_join(f'JOIN {bridge_table} ON {bridge_condition}', join_clauses)
+        add_join(f'JOIN {table} ON {join_condition}', join_clauses)
+    elif dim_type == 'primary':
+        add_join(f'JOIN {table} ON {join_condition}', join_clauses)
+
+
+def add_join(join_clause, join_clauses):
+    if join_clause not in join_clauses:
+        join_clauses.append(join_clause)
+
+
+def build_filter_clause(dim, value, params, table=None):
+    # Column names come from dim_table_map; only the values become placeholders
+    column = f'{table or dim_table_map[dim][0]}.{dim}'
+    if value is None:
+        return f'{column} IS NULL'
+    if isinstance(value, list):
+        params.extend(value)
+        return f"{column} IN ({', '.join('?' for _ in value)})"
+    if isinstance(value, tuple):
+        operator, operand = value
+        if operator not in filter_operators:
+            raise ValueError(f"Unsupported filter operator '{operator}' for {dim}.")
+        params.append(operand)
+        return f'{column} {operator} ?'
+    params.append(value)
+    return f'{column} = ?'
+
+
+def build_semi_join(dim, value, params):
+    # A bridge dimension used only as a filter restricts the movies through a
+    # subquery instead of a join, so a movie matching several bridge rows
+    # (two genres, several actors) is still counted once
+    table, join_condition, _, bridge_table, _ = dim_table_map[dim]
+    if bridge_table == 'Bridge_PrincipalProfessions':
+        source = 'Bridge_MoviePrincipals'
+        joins = f'JOIN Bridge_PrincipalProfessions ON Bridge_MoviePrincipals.personId = Bridge_PrincipalProfessions.personId JOIN {table} ON {join_condition}'
+    else:
+        source = bridge_table
+        joins = f'JOIN {table} ON {join_condition}'
+    return f'Fact_MovieData.movieId IN (SELECT {source}.movieId FROM {source} {joins} WHERE {build_filter_clause(dim, value, params)})'
+
+
+def single_value(value):
+    return value is not None and not isinstance(value, list) and (not isinstance(value, tuple) or value[0] == '=')
+
+
+def choose_aggregate_table(selected_dims, filters, ready_tables):
+    # The smallest refreshed summary table holding every selected and filtered dimension.
+    # Extra dimensions are summed away, which is only safe for primary ones:
+    # a bridge dimension would count a movie once per genre or person.
+    required_dims = set(selected_dims) | set(filters)
+
+    # The same holds for a filtered bridge dimension that is summed away: only a
+    # single equality keeps at most one of its rows per movie
+    for dim, value in filters.items():
+        if dim not in selected_dims and dim_table_map.get(dim, ('', '', 'primary'))[2] == 'secondary' and not single_value(value):
+            return None
+
+    for aggregate_table, aggregate_dims in aggregate_table_map.items():
+        if aggregate_table not in ready_tables:
+            continue
+        extra_dims = set(aggregate_dims) - required_dims
+        if required_dims <= set(aggregate_dims) and all(dim_table_map[dim][2] == 'primary' for dim in extra_dims):
+            return aggregate_table
+    return None
+
+
+def build_aggregate_query(aggregate_table, selected_measures, selected_dims, state=False, filters=None):
+    # Same result shape as the star query, re-aggregated from the stored sum/count state
+    select_clause = []
+    where_clause = []
+    group_by_clause = []
+    order_by_clause = []
+    params = []
+
+    for measure in selected_measures:
+        measure_sum = f'SUM({aggregate_table}.{measure}_sum)'
+        measure_count = f'SUM({aggregate_table}.{measure}_count)'
+        if state:
+            select_clause.append(f'{measure_sum} AS {measure}_sum')
+            select_clause.append(f'{measure_count} AS {measure}_count')
+            continue
+        expression = f'{measure_sum} / NULLIF({measure_count}, 0)' if measure == 'averageRating' else measure_sum
+        select_clause.append(f'{expression} AS {measure}')
+        order_by_clause.append(f'{expression} DESC')
+
+    for dim in selected_dims:
+        select_clause.append(f'{aggregate_table}.{dim}')
+        group_by_clause.append(f'{aggregate_table}.{dim}')
+
+    for dim, value in filters.items():
+        where_clause.append(build_filter_clause(dim, value, params, table=aggregate_table))
+
+    where_string = f"WHERE {' AND '.join(where_clause)}" if where_clause else ''
+    order_by_string = f"ORDER BY {', '.join(order_by_clause)}" if order_by_clause else ''
+
+    query = f"""
+    SELECT {', '.join(select_clause)}
+    FROM {aggregate_table}
+    {where_string}
+    GROUP BY {', '.join(group_by_clause)}
+    {order_by_string}
+    """
+    return query, params
+
+
+def build_dynamic_query(selected_measures, selected_dims, state=False, filters=None, use_aggregates=True):
+    filters = filters or {}
+
+    # Answer from a summary table when one covers the request; the refresh of
+    # those tables passes use_aggregates=False to read the base star instead
+    if use_aggregates:
+        aggregate_table = choose_aggregate_table(selected_dims, filters, get_ready_aggregate_tables())
+        if aggregate_table is not None:
+            return build_aggregate_query(aggregate_table, selected_measures, selected_dims, state, filters)
+
     select_clause = []
     join_clauses = []
+    where_clause = []
     group_by_clause = []
     order_by_clause = []
+    params = []
 
     # Add measures to the select clause
     for measure in selected_measures:
+        if state:
+            # Mergeable sum/count state, so the cube can be rolled up later
+            select_clause.append(f'SUM(Fact_MovieData.{measure}) AS {measure}_sum')
+            select_clause.append(f'COUNT(Fact_MovieData.{measure}) AS {measure}_count')
+            continue
         agg_function = 'AVG' if measure == 'averageRating' else 'SUM'
         select_clause.append(f'{agg_function}(Fact_MovieData.{measure}) AS {measure}')
         order_by_clause.append(f'{agg_function}(Fact_MovieData.{measure}) DESC')
@@ -24,36 +159,67 @@ def build_dynamic_query(selected_measures, selected_dims):
     # Process dimensions and determine join conditions
     for dim in selected_dims:
         if dim in dim_table_map:
-            table, join_condition, dim_type, *bridge_info = dim_table_map[dim]
+            table = dim_table_map[dim][0]
             select_clause.append(f'{table}.{dim}')
             group_by_clause.append(f'{table}.{dim}')
+            add_dim_joins(dim, join_clauses)
 
-            if dim_type == 'secondary' and bridge_info:
-                bridge_table, bridge_condition = bridge_info[:2]
-                join_clauses.append(f'JOIN {bridge_table} ON {bridge_condition}')
-                join_clauses.append(f'JOIN {table} ON {join_condition}')
-            elif dim_type == 'primary':
-                join_clauses.append(f'JOIN {table} ON {join_condition}')
-
-    # Special handling for the profession dimension
-    if 'profession' in selected_dims:
-        join_clauses.clear()  # Clear existing joins to handle profession specifically
-        join_clauses.append('JOIN Bridge_MoviePrincipals ON Fact_MovieData.movieId = Bridge_MoviePrincipals.movieId')
-        join_clauses.append('JOIN Bridge_PrincipalProfessions ON Bridge_MoviePrincipals.personId = Bridge_PrincipalProfessions.personId')
-        join_clauses.append('JOIN DimProfession ON Bridge_PrincipalProfessions.professionId = DimProfession.professionId')
+    # Filters bind their values as parameters. Primary dimensions and dimensions
+    # whose table is already joined for grouping filter the joined rows; other
+    # bridge dimensions become semi-joins, so they cannot fan out the facts.
+    grouped_tables = {dim_table_map[dim][0] for dim in selected_dims if dim in dim_table_map}
+    for dim, value in filters.items():
+        if dim not in dim_table_map or dim_table_map[dim][2] == 'bridge':
+            raise ValueError(f"Unknown filter dimension '{dim}'.")
+        if dim_table_map[dim][2] == 'secondary' and dim_table_map[dim][0] not in grouped_tables:
+            where_clause.append(build_semi_join(dim, value, params))
+        else:
+            add_dim_joins(dim, join_clauses)
+            where_clause.append(build_filter_clause(dim, value, params))
 
     # Combine all joins
     join_clause_string = ' '.join(join_clauses)
+    where_string = f"WHERE {' AND '.join(where_clause)}" if where_clause else ''
+
+    # State queries are re-aggregated locally, so they skip the ORDER BY
+    order_by_string = f"ORDER BY {', '.join(order_by_clause)}" if order_by_clause else ''
 
-    # Build the complete SQL query
+    # Build the complete SQL query; the text only depends on the cube shape,
+    # so repeated requests with different filter values share one server plan
     query = f"""
     SELECT {', '.join(select_clause)}
     FROM Fact_MovieData
     {join_clause_string}
+    {where_string}
     GROUP BY {', '.join(group_by_clause)}
-    ORDER BY {', '.join(order_by_clause)}
+    {order_by_string}
     """
-    return query
+    return query, params
+
+
+def parse_filter(filter_arg):
+    # Parse DIM<op>VALUE, e.g. genreName=Drama or startYear>=1980
+    match = re.match(r'^(\w+)(<=|>=|<>|=|<|>)(.*)$', filter_arg)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid filter '{filter_arg}'. Use DIM=VALUE or DIM>=VALUE.")
+    dim, operator, value = match.groups()
+    if re.fullmatch(r'-?\d+', value):
+        value = int(value)
+    return dim, operator, value
+
+
+def build_filters(parsed_filters):
+    # Repeated DIM=VALUE filters on one dimension become an IN list
+    filters = {}
+    for dim, operator, value in parsed_filters:
+        if operator != '=':
+            filters[dim] = (operator, value)
+        elif dim in filters:
+            previous = filters[dim]
+            filters[dim] = (previous if isinstance(previous, list) else [previous]) + [value]
+        else:
+            filters[dim] = value
+    return filters
 
 
 def main():
@@ -64,10 +230,17 @@ def main():
     parser.add_argument('--measure', choices=['averageRating', 'numVotes', 'both'], default='both',
                         help='Choose the measure(s) for the data cube. Options: averageRating, numVotes, both.')
     user_friendly_dims = [dim for dim, details in dim_table_map.items() if details[-1] != 'bridge']
+    # Derived hierarchy levels (decade, era, runtimeBucket) are rolled up locally
+    user_friendly_dims += [level for levels in dim_hierarchies.values() for level in levels if level not in user_friendly_dims]
     parser.add_argument('--dim', required=True, choices=user_friendly_dims,
                     help='Choose one dimension from the list of available dimensions.')
+    parser.add_argument('--filter', action='append', type=parse_filter, default=[],
+                        help='Filter the cube, e.g. --filter genreName=Drama --filter startYear>=1980. Can be repeated.')
     parser.add_argument('--output', default='../analysis_results/output.csv',
                         help='Specify the output file path for the data cube. Default is "../analysis_results/output.csv".')
+    parser.add_argument('--format', choices=list(output_formats),
+                        help='Output format; replaces the extension of --output. By default the format follows the '
+                             '--output extension (.csv, .csv.gz, .csv.zst, .parquet, .feather).')
 
     # Check if no arguments were provided (just the script name)
     if len(sys.argv) == 1:
@@ -86,14 +259,21 @@ def main():
     # Handle dimensions
     selected_dims = [args.dim]
 
-    # Build and execute query
-    query = build_dynamic_query(selected_measures, selected_dims)
-    result_df = execute_sql_query(query)
+    # Build and execute query, or roll up a cached finer cube for derived levels
+    filters = build_filters(args.filter)
+    if all(dim in dim_table_map for dim in selected_dims):
+        query, params = build_dynamic_query(selected_measures, selected_dims, filters=filters)
+        result_df = execute_sql_query(query, params)
+    elif filters:
+        parser.error('--filter is not supported together with derived hierarchy levels.')
+    else:
+        # Imported here because cube_cache itself imports this module
+        from cube_cache import get_cube
+        result_df = get_cube(selected_measures, selected_dims)
 
-    # Save to CSV
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    result_df.to_csv(args.output, index=False)
-    print(f'Data cube saved to {args.output}')
+    # Save in the requested format
+    output_path = write_result(result_df, args.output, args.format)
+    print(f'Data cube saved to {output_path}')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+import os
+import itertools
+import pandas as pd
+from create_datacube import build_dynamic_query
+from utils import dim_table_map, dim_hierarchies, era_bounds, runtime_buckets, fact_measures, execute_sql_query
+
+
+def find_hierarchy(dim):
+    # Return the hierarchy levels containing the dimension and its position
+    for levels in dim_hierarchies.values():
+        if dim in levels:
+            return levels, levels.index(dim)
+    return None, None
+
+
+def map_decade(years):
+    mapping = pd.DataFrame({'year': years})
+    mapping['decade'] = (mapping['year'] // 10) * 10
+    return mapping
+
+
+def map_era(decades):
+    mapping = pd.DataFrame({'decade': decades})
+    bins = [start for start, _ in era_bounds] + [float('inf')]
+    labels = [label for _, label in era_bounds]
+    mapping['era'] = pd.cut(mapping['decade'], bins=bins, labels=labels, right=False).astype(object)
+    return mapping
+
+
+def map_runtime_bucket(runtimes):
+    mapping = pd.DataFrame({'runtimeMinutes': runtimes})
+    bins = [0] + [upper for upper, _ in runtime_buckets]
+    labels = [label for _, label in runtime_buckets]
+    mapping['runtimeBucket'] = pd.cut(mapping['runtimeMinutes'], bins=bins, labels=labels, right=False).astype(object)
+    return mapping
+
+
+# Level name -> function mapping the values of the level below it
+level_mappers = {
+    'decade': map_decade,
+    'era': map_era,
+    'runtimeBucket': map_runtime_bucket,
+}
+
+
+def state_columns(measures):
+    return [f'{measure}_{part}' for measure in measures for part in ('sum', 'count')]
+
+
+def cube_cache_path(selected_dims, cache_dir):
+    return os.path.join(cache_dir, '__'.join(selected_dims) + '.csv')
+
+
+def load_cached_cube(selected_dims, cache_dir):
+    cache_path = cube_cache_path(selected_dims, cache_dir)
+    if not os.path.exists(cache_path):
+        return None
+    return pd.read_csv(cache_path)
+
+
+def save_cached_cube(state_df, selected_dims, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    state_df.to_csv(cube_cache_path(selected_dims, cache_dir), index=False)
+
+
+def clear_cube_cache(cache_dir='../cube_cache/'):
+    # Cached cubes are snapshots of the database, so every load invalidates them
+    if os.path.isdir(cache_dir):
+        for file_name in os.listdir(cache_dir):
+            if file_name.endswith('.csv'):
+                os.remove(os.path.join(cache_dir, file_name))
+
+
+def fetch_cube_state(selected_dims, cache_dir):
+    # Serve the state from the cache, or scan the database once and cache it
+    state_df = load_cached_cube(selected_dims, cache_dir)
+    if state_df is None:
+        # Every fact measure is cached, so one cube answers any measure combination
+        query, params = build_dynamic_query(fact_measures, selected_dims, state=True)
+        state_df = execute_sql_query(query, params)
+        save_cached_cube(state_df, selected_dims, cache_dir)
+    return state_df
+
+
+def roll_up(state_df, from_dims, to_dims):
+    # Re-aggregate the state one hierarchy step at a time
+    current_dims = list(from_dims)
+    for position, (from_dim, to_dim) in enumerate(zip(from_dims, to_dims)):
+        if from_dim == to_dim:
+            continue
+        levels, start = find_hierarchy(from_dim)
+        for level in levels[start + 1:levels.index(to_dim) + 1]:
+            below = current_dims[position]
+            mapping = level_mappers[level](state_df[below].unique())
+            state_df = state_df.merge(mapping, on=below).drop(columns=[below])
+            current_dims[position] = level
+            state_df = state_df.groupby(current_dims, dropna=False, as_index=False)[state_columns(fact_measures)].sum()
+    return state_df[current_dims + state_columns(fact_measures)]
+
+
+def finalize_cube(state_df, selected_measures, selected_dims):
+    # Turn sum/count state into the same columns the SQL cube query returns
+    result_df = pd.DataFrame(index=state_df.index)
+    for measure in selected_measures:
+        if measure == 'averageRating':
+            result_df[measure] = state_df[f'{measure}_sum'] / state_df[f'{measure}_count']
+        else:
+            result_df[measure] = state_df[f'{measure}_sum']
+    for dim in selected_dims:
+        result_df[dim] = state_df[dim]
+    return result_df.sort_values(selected_measures, ascending=False).reset_index(drop=True)
+
+
+def finer_grains(selected_dims):
+    # Candidate grains from the requested one down to the finest levels
+    candidates = []
+    for dim in selected_dims:
+        levels, index = find_hierarchy(dim)
+        candidates.append([dim] if levels is None else levels[index::-1])
+    return itertools.product(*candidates)
+
+
+def queryable_grain(selected_dims):
+    # Closest finer level of each dimension that the database can group by
+    grain = []
+    for dim in selected_dims:
+        levels, index = find_hierarchy(dim)
+        if dim not in dim_table_map:
+            dim = next(level for level in levels[index::-1] if level in dim_table_map)
+        grain.append(dim)
+    return grain
+
+
+def get_cube(selected_measures, selected_dims, cache_dir='../cube_cache/'):
+    # Prefer the coarsest cached cube that can answer the request
+    for grain in finer_grains(selected_dims):
+        state_df = load_cached_cube(grain, cache_dir)
+        if state_df is not None:
+            state_df = roll_up(state_df, grain, selected_dims)
+            return finalize_cube(state_df, selected_measures, selected_dims)
+
+    # Otherwise scan the database once at a queryable grain and roll up from there
+    grain = queryable_grain(selected_dims)
+    state_df = fetch_cube_state(grain, cache_dir)
+    state_df = roll_up(state_df, grain, selected_dims)
+    return finalize_cube(state_df, selected_measures, selected_dims)
@@ -0,0 +1,85 @@
+import os
+import pandas as pd
+from star_schema import star_table_names, star_table_keys, star_surrogate_keys
+
+
+# Change types written to the changeType column of a delta file
+INSERT, UPDATE, DELETE = 'I', 'U', 'D'
+
+
+def read_star_csv_as_text(csv_path):
+    # Hash the exact CSV text, so type inference cannot make unchanged rows look changed
+    return pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+
+
+def row_hashes(df, table):
+    # One 64-bit hash per natural key over every non-key, non-surrogate column
+    keys = star_table_keys[table]
+    value_columns = [column for column in df.columns if column not in keys and column != star_surrogate_keys.get(table)]
+    hashes = df[keys].copy()
+    if value_columns:
+        hashes['rowHash'] = pd.util.hash_pandas_object(df[value_columns], index=False).astype(str).to_numpy()
+    else:
+        hashes['rowHash'] = '0'
+    return hashes
+
+
+def load_snapshot(table, snapshot_folder):
+    snapshot_path = os.path.join(snapshot_folder, table + '.csv')
+    if not os.path.exists(snapshot_path):
+        return pd.DataFrame(columns=star_table_keys[table] + ['rowHash'], dtype=str)
+    return pd.read_csv(snapshot_path, dtype=str, keep_default_na=False)
+
+
+def compute_table_delta(table, data_folder, snapshot_folder):
+    # Compare the current star CSV with the last applied snapshot, per natural key
+    keys = star_table_keys[table]
+    current_df = read_star_csv_as_text(os.path.join(data_folder, table + '.csv'))
+    current_hashes = row_hashes(current_df, table)
+    previous_hashes = load_snapshot(table, snapshot_folder)
+
+    compared = current_hashes.merge(previous_hashes, on=keys, how='outer', suffixes=('', '_previous'), indicator=True)
+    inserted = compared.loc[compared['_merge'] == 'left_only', keys]
+    updated = compared.loc[(compared['_merge'] == 'both') & (compared['rowHash'] != compared['rowHash_previous']), keys]
+    deleted = compared.loc[compared['_merge'] == 'right_only', keys]
+
+    # Inserts and updates carry the full row; deletes only need the key
+    delta_df = pd.concat([
+        current_df.merge(inserted, on=keys).assign(changeType=INSERT),
+        current_df.merge(updated, on=keys).assign(changeType=UPDATE),
+        deleted.assign(changeType=DELETE),
+    ], ignore_index=True)
+    return delta_df[list(current_df.columns) + ['changeType']], current_hashes
+
+
+def write_table_delta(table, data_folder, snapshot_folder, delta_folder):
+    # Write the delta and the snapshot it leads to; the loader promotes the
+    # snapshot only after the delta is applied, so a failed load is retried
+    os.makedirs(delta_folder, exist_ok=True)
+    delta_df, current_hashes = compute_table_delta(table, data_folder, snapshot_folder)
+    delta_df.to_csv(os.path.join(delta_folder, table + '.csv'), index=False)
+    current_hashes.to_csv(os.path.join(delta_folder, table + '.snapshot.csv'), index=False)
+
+    counts = delta_df['changeType'].value_counts()
+    print(f"{table} delta: {counts.get(INSERT, 0)} inserted, {counts.get(UPDATE, 0)} updated, {counts.get(DELETE, 0)} deleted.")
+    return delta_df
+
+
+def write_star_deltas(data_folder, snapshot_folder='../datasets_snapshot/', delta_folder='../datasets_delta/'):
+    return {table: write_table_delta(table, data_folder, snapshot_folder, delta_folder) for table in star_table_names}
+
+
+def write_snapshot(table, data_folder, snapshot_folder='../datasets_snapshot/'):
+    # Record the snapshot of a table loaded in full
+    os.makedirs(snapshot_folder, exist_ok=True)
+    current_df = read_star_csv_as_text(os.path.join(data_folder, table + '.csv'))
+    row_hashes(current_df, table).to_csv(os.path.join(snapshot_folder, table + '.csv'), index=False)
+
+
+def promote_snapshot(table, delta_folder='../datasets_delta/', snapshot_folder='../datasets_snapshot/'):
+    # Called once the table's delta is committed in the database
+    os.makedirs(snapshot_folder, exist_ok=True)
+    pending_path = os.path.join(delta_folder, table + '.snapshot.csv')
+    if os.path.exists(pending_path):
+        os.replace(pending_path, os.path.join(snapshot_folder, table + '.csv'))
+        os.remove(os.path.join(delta_folder, table + '.csv'))
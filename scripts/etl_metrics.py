@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then only reported where /proc exists
+    resource = None
+
+
+# Stage fields exported as Prometheus gauges, with their metric names
+prometheus_gauges = {
+    'rows_in': 'etl_stage_rows_in',
+    'rows_out': 'etl_stage_rows_out',
+    'elapsed_seconds': 'etl_stage_duration_seconds',
+    'rows_per_second': 'etl_stage_rows_per_second',
+    'peak_rss_bytes': 'etl_stage_peak_rss_bytes',
+    'bytes_written': 'etl_stage_bytes_written',
+}
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its RSS high-water mark, giving a per-stage peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def read_peak_rss():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return None
+
+
+def start_run(pipeline):
+    return {
+        'run_id': uuid.uuid4().hex,
+        'pipeline': pipeline,
+        'started_at': time.time(),
+        'stages': [],
+    }
+
+
+def record_rows(stage, **counts):
+    # Let the ETL functions report counts without depending on a run being tracked
+    if stage is not None:
+        stage.update(counts)
+
+
+@contextmanager
+def track_stage(run, name, output_path=None):
+    stage = {'stage': name, 'status': 'success', 'rows_in': None, 'rows_out': None, 'bytes_written': None}
+    reset_peak_rss()
+    start_time = time.perf_counter()
+    try:
+        yield stage
+    except Exception as e:
+        stage['status'] = 'failed'
+        stage['error'] = str(e)
+        raise
+    finally:
+        stage['elapsed_seconds'] = time.perf_counter() - start_time
+        stage['peak_rss_bytes'] = read_peak_rss()
+        if output_path is not None and os.path.exists(output_path):
+            stage['bytes_written'] = os.path.getsize(output_path)
+        rows = stage['rows_out'] if stage['rows_out'] is not None else stage['rows_in']
+        stage['rows_per_second'] = rows / stage['elapsed_seconds'] if rows is not None and stage['elapsed_seconds'] > 0 else None
+        if run is not None:
+            run['stages'].append(stage)
+        print(format_stage(stage))
+
+
+def format_stage(stage):
+    rate = f"{stage['rows_per_second']:,.0f} rows/s" if stage['rows_per_second'] is not None else 'n/a rows/s'
+    peak = f"{stage['peak_rss_bytes'] / 2 ** 20:.1f} MiB" if stage['peak_rss_bytes'] is not None else 'n/a'
+    return (f"[{stage['status']}] {stage['stage']}: in={stage['rows_in']} out={stage['rows_out']} "
+            f"{stage['elapsed_seconds']:.2f}s {rate} peak RSS {peak}")
+
+
+def prometheus_text(run):
+    lines = []
+    for field, metric in prometheus_gauges.items():
+        lines.append(f'# TYPE {metric} gauge')
+        for stage in run['stages']:
+            if stage.get(field) is not None:
+                lines.append(f'{metric}{{pipeline="{run["pipeline"]}",stage="{stage["stage"]}"}} {stage[field]}')
+
+    lines.append('# TYPE etl_stage_success gauge')
+    for stage in run['stages']:
+        lines.append(f'etl_stage_success{{pipeline="{run["pipeline"]}",stage="{stage["stage"]}"}} {int(stage["status"] == "success")}')
+
+    lines.append('# TYPE etl_run_last_timestamp_seconds gauge')
+    lines.append(f'etl_run_last_timestamp_seconds{{pipeline="{run["pipeline"]}"}} {run["finished_at"]}')
+    lines.append('# TYPE etl_run_duration_seconds gauge')
+    lines.append(f'etl_run_duration_seconds{{pipeline="{run["pipeline"]}"}} {run["finished_at"] - run["started_at"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def finish_run(run, log_folder='../etl_logs/'):
+    # Append the run to the JSON-lines run log and rewrite the Prometheus textfile
+    run['finished_at'] = time.time()
+    run['status'] = 'success' if all(stage['status'] == 'success' for stage in run['stages']) else 'failed'
+    os.makedirs(log_folder, exist_ok=True)
+
+    with open(os.path.join(log_folder, f"{run['pipeline']}_runs.jsonl"), 'a') as run_log:
+        run_log.write(json.dumps(run) + '\n')
+
+    # Write to a temp file and rename, so a scraper never reads a partial file
+    prom_path = os.path.join(log_folder, f"{run['pipeline']}.prom")
+    with open(prom_path + '.tmp', 'w') as prom_file:
+        prom_file.write(prometheus_text(run))
+    os.replace(prom_path + '.tmp', prom_path)
+
+    print(f"Run {run['run_id']} {run['status']}: metrics written to {log_folder}")
+    return run
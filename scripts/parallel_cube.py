@@ -0,0 +1,319 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+from cube_cache import finalize_cube
+from utils import dim_table_map
+from star_schema import load_star_tables
+from result_writers import output_formats, write_result
+
+
+def dim_key_pairs(tables, dim):
+    # Return the fact join column and the (key, group label) pairs the dimension joins through
+    if dim == 'year':
+        return 'dateKey', tables['DimDate'][['dateKey', 'year']].set_axis(['key', 'label'], axis=1)
+
+    if dim_table_map[dim][0] == 'DimMovie':
+        return 'movieId', tables['DimMovie'][['movieId', dim]].set_axis(['key', 'label'], axis=1)
+
+    if dim == 'genreName':
+        pairs = tables['Bridge_MovieGenres'].merge(tables['DimGenre'], on='genreId')
+        return 'movieId', pairs[['movieId', 'genreName']].set_axis(['key', 'label'], axis=1)
+
+    if dim == 'profession':
+        pairs = tables['Bridge_MoviePrincipals'][['movieId', 'personId']]
+        pairs = pairs.merge(tables['Bridge_PrincipalProfessions'], on='personId').merge(tables['DimProfession'], on='professionId')
+        return 'movieId', pairs[['movieId', 'profession']].set_axis(['key', 'label'], axis=1)
+
+    # Remaining secondary dimensions live on DimPerson
+    pairs = tables['Bridge_MoviePrincipals'][['movieId', 'personId']].merge(tables['DimPerson'], on='personId')
+    return 'movieId', pairs[['movieId', dim]].set_axis(['key', 'label'], axis=1)
+
+
+def encode_dimension(tables, dim):
+    # Encode the dimension side of the join as CSR arrays: key code -> group codes.
+    # Only dimension-sized work happens here; fact rows are encoded by the workers.
+    fact_column, pairs = dim_key_pairs(tables, dim)
+    key_codes, key_values = pd.factorize(pairs['key'])
+    group_codes, group_labels = pd.factorize(pairs['label'], use_na_sentinel=False)
+
+    order = np.argsort(key_codes, kind='stable')
+    indptr = np.zeros(len(key_values) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(key_codes, minlength=len(key_values)))
+    indices = group_codes[order].astype(np.int64)
+    return {'fact_column': fact_column, 'key_values': key_values, 'indptr': indptr,
+            'indices': indices, 'group_labels': group_labels}
+
+
+def partition_cuts(fact_df, partition_by, n_partitions):
+    # dateKey cut points at roughly equal row counts, estimated from a sample of the rows
+    if partition_by != 'dateKey' or len(fact_df) == 0:
+        return np.array([], dtype=np.int64)
+    sample = fact_df['dateKey'].iloc[::max(len(fact_df) // 100_000, 1)].to_numpy(dtype=np.int64)
+    return np.unique(np.quantile(sample, np.arange(1, n_partitions) / n_partitions, method='higher'))
+
+
+def to_shared_memory(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def empty_shared_memory(shape, dtype):
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+    return shm, (shm.name, shape, np.dtype(dtype).str)
+
+
+def attach_shared_memory(specs):
+    handles = {name: shared_memory.SharedMemory(name=spec[0]) for name, spec in specs.items()}
+    arrays = {name: np.ndarray(spec[1], dtype=spec[2], buffer=handles[name].buf) for name, spec in specs.items()}
+    return handles, arrays
+
+
+# Per-process state set by init_worker: the fact frame and the dimension arrays
+worker_state = {}
+
+
+def init_worker(fact_df, dimension):
+    # With the fork start method the fact frame is inherited rather than copied;
+    # elsewhere it is pickled once per worker, never once per task
+    worker_state['fact_df'] = fact_df
+    worker_state['key_index'] = pd.Index(dimension['key_values'])
+    worker_state.update({name: dimension[name] for name in ('fact_column', 'indptr', 'indices')})
+
+
+def start_workers(tables, dim, workers):
+    dimension = encode_dimension(tables, dim)
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    # Forked workers must share the parent's tracker, or theirs would warn about the blocks the parent unlinks
+    resource_tracker.ensure_running()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                   initargs=(tables['Fact_MovieData'], dimension))
+    return executor, dimension
+
+
+def encode_chunk(specs, measures, start, stop, partition_by, cuts, n_partitions):
+    # Phase 1: encode a contiguous chunk of fact rows into the shared arrays
+    fact_df = worker_state['fact_df'].iloc[start:stop]
+    handles, arrays = attach_shared_memory(specs)
+
+    # Fact rows without a matching key get -1 and drop out, like an inner join
+    arrays['fact_keys'][start:stop] = worker_state['key_index'].get_indexer(fact_df[worker_state['fact_column']])
+    if partition_by == 'dateKey':
+        arrays['partition_ids'][start:stop] = np.searchsorted(cuts, fact_df['dateKey'].to_numpy(dtype=np.int64), side='right')
+    else:
+        arrays['partition_ids'][start:stop] = pd.util.hash_pandas_object(fact_df['movieId'], index=False).to_numpy() % n_partitions
+    for measure in measures:
+        arrays[measure][start:stop] = fact_df[measure].to_numpy(dtype=np.float64, na_value=np.nan)
+    counts = np.bincount(arrays['partition_ids'][start:stop], minlength=n_partitions)
+
+    # Views must be released before the shared blocks can be closed
+    del arrays
+    for handle in handles.values():
+        handle.close()
+    return counts
+
+
+def bucket_chunk(specs, start, stop, offsets):
+    # Counting-sort step: write the chunk's row numbers into each partition's slice of
+    # partition_rows, starting at the offsets the parent derived from all chunk counts
+    handles, arrays = attach_shared_memory(specs)
+    order = np.argsort(arrays['partition_ids'][start:stop], kind='stable')
+    chunk_counts = np.bincount(arrays['partition_ids'][start:stop], minlength=len(offsets))
+    chunk_starts = np.cumsum(chunk_counts) - chunk_counts
+    for partition in np.flatnonzero(chunk_counts):
+        begin, count = offsets[partition], chunk_counts[partition]
+        arrays['partition_rows'][begin:begin + count] = start + order[chunk_starts[partition]:chunk_starts[partition] + count]
+
+    del arrays
+    for handle in handles.values():
+        handle.close()
+
+
+def aggregate_partition(specs, measures, begin, end, n_groups):
+    # Phase 2: aggregate one dateKey range or movie hash partition, reading only its slice
+    handles, arrays = attach_shared_memory(specs)
+    rows = arrays['partition_rows'][begin:end]
+    keys = arrays['fact_keys'][rows]
+    matched = keys >= 0
+    rows, keys = rows[matched], keys[matched]
+    indptr, indices = worker_state['indptr'], worker_state['indices']
+
+    # Expand each fact row once per group it joins to (the bridge fan-out)
+    fanout = indptr[keys + 1] - indptr[keys]
+    fanned_rows = np.repeat(rows, fanout)
+    offsets = np.arange(fanout.sum()) - np.repeat(np.cumsum(fanout) - fanout, fanout)
+    groups = indices[np.repeat(indptr[keys], fanout) + offsets]
+
+    # Joined row count per group, so groups no fact row reached can be dropped
+    partials = {'rows': np.bincount(groups, minlength=n_groups)}
+    for measure in measures:
+        values = arrays[measure][fanned_rows]
+        present = ~np.isnan(values)
+        values, value_groups = values[present], groups[present]
+
+        partials[f'{measure}_sum'] = np.bincount(value_groups, weights=values, minlength=n_groups)
+        partials[f'{measure}_count'] = np.bincount(value_groups, minlength=n_groups).astype(np.float64)
+        partials[f'{measure}_min'] = np.full(n_groups, np.inf)
+        partials[f'{measure}_max'] = np.full(n_groups, -np.inf)
+        np.minimum.at(partials[f'{measure}_min'], value_groups, values)
+        np.maximum.at(partials[f'{measure}_max'], value_groups, values)
+
+    del arrays
+    for handle in handles.values():
+        handle.close()
+    return partials
+
+
+def merge_partials(partials, measures, n_groups):
+    merged = {'rows': np.sum([p['rows'] for p in partials], axis=0) if partials else np.zeros(n_groups, dtype=np.int64)}
+    for measure in measures:
+        merged[f'{measure}_sum'] = np.sum([p[f'{measure}_sum'] for p in partials], axis=0) if partials else np.zeros(n_groups)
+        merged[f'{measure}_count'] = np.sum([p[f'{measure}_count'] for p in partials], axis=0) if partials else np.zeros(n_groups)
+        merged[f'{measure}_min'] = np.min([p[f'{measure}_min'] for p in partials], axis=0) if partials else np.full(n_groups, np.inf)
+        merged[f'{measure}_max'] = np.max([p[f'{measure}_max'] for p in partials], axis=0) if partials else np.full(n_groups, -np.inf)
+    return merged
+
+
+def parallel_cube_state(tables, selected_measures, dim, workers=None, partition_by='dateKey', pool=None):
+    # pool is a (executor, dimension) pair from start_workers; one is started here if not given
+    workers = workers or os.cpu_count()
+    executor, dimension = pool or start_workers(tables, dim, workers)
+    fact_df = tables['Fact_MovieData']
+    n_groups = len(dimension['group_labels'])
+    cuts = partition_cuts(fact_df, partition_by, workers)
+    n_partitions = len(cuts) + 1 if partition_by == 'dateKey' else workers
+
+    # Shared arrays the workers fill in phase 1 and read in phase 2
+    shapes = {'fact_keys': np.int64, 'partition_ids': np.int32, 'partition_rows': np.int64}
+    shapes.update({measure: np.float64 for measure in selected_measures})
+    blocks, specs = [], {}
+    try:
+        for name, dtype in shapes.items():
+            shm, specs[name] = empty_shared_memory((len(fact_df),), dtype)
+            blocks.append(shm)
+
+        chunk_bounds = np.linspace(0, len(fact_df), workers + 1).astype(int)
+        chunks = list(zip(chunk_bounds[:-1], chunk_bounds[1:]))
+        encoded = [executor.submit(encode_chunk, specs, selected_measures, start, stop, partition_by, cuts, n_partitions)
+                   for start, stop in chunks]
+        chunk_counts = np.array([future.result() for future in encoded]).reshape(len(chunks), n_partitions)
+
+        # Partition p owns partition_rows[partition_bounds[p]:partition_bounds[p + 1]]; inside it,
+        # each chunk writes after the rows of the chunks before it
+        partition_bounds = np.concatenate([[0], np.cumsum(chunk_counts.sum(axis=0))])
+        chunk_offsets = partition_bounds[:-1] + np.cumsum(chunk_counts, axis=0) - chunk_counts
+        bucketed = [executor.submit(bucket_chunk, specs, start, stop, offsets)
+                    for (start, stop), offsets in zip(chunks, chunk_offsets)]
+        for future in bucketed:
+            future.result()
+
+        futures = [executor.submit(aggregate_partition, specs, selected_measures, begin, end, n_groups)
+                   for begin, end in zip(partition_bounds[:-1], partition_bounds[1:])]
+        partials = [future.result() for future in futures]
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+        if pool is None:
+            executor.shutdown()
+
+    merged = merge_partials(partials, selected_measures, n_groups)
+    state_df = pd.DataFrame(merged)
+    state_df.insert(0, dim, dimension['group_labels'])
+
+    # Groups no fact row reached would not appear in a SQL GROUP BY either
+    state_df = state_df[state_df['rows'] > 0].drop(columns=['rows']).reset_index(drop=True)
+    for measure in selected_measures:
+        state_df[f'{measure}_min'] = state_df[f'{measure}_min'].replace(np.inf, np.nan)
+        state_df[f'{measure}_max'] = state_df[f'{measure}_max'].replace(-np.inf, np.nan)
+    return state_df
+
+
+# Below about a million fact rows the pool overhead dominates and scaling cannot be seen
+BENCHMARK_ROWS = 2_000_000
+
+
+def scale_fact_table(tables, rows):
+    # Synthetic dataset: repeat the fact rows up to the requested count, keeping
+    # movieIds so every join still matches
+    base_df = tables['Fact_MovieData']
+    repeats = -(-rows // max(len(base_df), 1))
+    fact_df = pd.concat([base_df] * repeats, ignore_index=True).iloc[:rows].copy()
+    fact_df['factId'] = np.arange(1, len(fact_df) + 1)
+    return dict(tables, Fact_MovieData=fact_df)
+
+
+def run_benchmark(tables, selected_measures, dim, rows, partition_by):
+    tables = scale_fact_table(tables, rows)
+    print(f'Benchmark: {rows} fact rows, dimension {dim}, partitioned by {partition_by}')
+
+    worker_counts = sorted({1, 2, 4, 8, os.cpu_count()} & set(range(1, os.cpu_count() + 1)))
+    baseline = None
+    for workers in worker_counts:
+        # Start and warm up the pool outside the timed section, so only the cube work is measured
+        pool = start_workers(tables, dim, workers)
+        try:
+            list(pool[0].map(time.sleep, [0.1] * workers))
+            start_time = time.perf_counter()
+            parallel_cube_state(tables, selected_measures, dim, workers=workers, partition_by=partition_by, pool=pool)
+            elapsed = time.perf_counter() - start_time
+        finally:
+            pool[0].shutdown()
+        baseline = baseline or elapsed
+        print(f'  workers={workers:<3} time={elapsed:.3f}s rows/sec={rows / elapsed:,.0f} speedup={baseline / elapsed:.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate the movie star schema locally across CPU cores.')
+    parser.add_argument('--measure', choices=['averageRating', 'numVotes', 'both'], default='both',
+                        help='Choose the measure(s) for the data cube. Options: averageRating, numVotes, both.')
+    user_friendly_dims = [dim for dim, details in dim_table_map.items() if details[-1] != 'bridge']
+    parser.add_argument('--dim', required=True, choices=user_friendly_dims,
+                        help='Choose one dimension from the list of available dimensions.')
+    parser.add_argument('--partition', choices=['dateKey', 'movie'], default='dateKey',
+                        help='Partition the fact table by dateKey range or by movieId hash. Default is dateKey.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes. Default is the number of CPU cores.')
+    parser.add_argument('--data', default='../datasets_validated/',
+                        help='Specify the folder holding the validated star schema CSV files. Default is "../datasets_validated/".')
+    parser.add_argument('--output', default='../analysis_results/output.csv',
+                        help='Specify the output file path for the data cube. Default is "../analysis_results/output.csv".')
+    parser.add_argument('--format', choices=list(output_formats),
+                        help='Output format; replaces the extension of --output. By default the format follows the '
+                             '--output extension (.csv, .csv.gz, .csv.zst, .parquet, .feather).')
+    parser.add_argument('--benchmark', type=int, nargs='?', const=BENCHMARK_ROWS, metavar='ROWS',
+                        help=f'Benchmark throughput on a synthetic fact table of ROWS rows. Default is {BENCHMARK_ROWS}.')
+
+    # Check if no arguments were provided (just the script name)
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+
+    if args.measure == 'both':
+        selected_measures = ['averageRating', 'numVotes']
+    else:
+        selected_measures = [args.measure]
+
+    tables = load_star_tables(args.data)
+
+    if args.benchmark:
+        run_benchmark(tables, selected_measures, args.dim, args.benchmark, args.partition)
+        return
+
+    state_df = parallel_cube_state(tables, selected_measures, args.dim, workers=args.workers, partition_by=args.partition)
+    result_df = finalize_cube(state_df, selected_measures, [args.dim])
+
+    output_path = write_result(result_df, args.output, args.format)
+    print(f'Data cube saved to {output_path}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    # Parquet and Feather output are only offered when pyarrow is installed
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Output formats with their file extension and the optional package each one needs
+output_formats = {
+    'csv': ('.csv', None),
+    'csv.gz': ('.csv.gz', None),
+    'csv.zst': ('.csv.zst', 'zstandard'),
+    'parquet': ('.parquet', 'pyarrow'),
+    'feather': ('.feather', 'pyarrow'),
+}
+optional_packages = {'pyarrow': pyarrow, 'zstandard': zstandard}
+
+
+def detect_format(path):
+    # Longest extension first, so .csv.gz is not taken for .csv
+    for output_format, (extension, _) in sorted(output_formats.items(), key=lambda item: -len(item[1][0])):
+        if path.lower().endswith(extension):
+            return output_format
+    return 'csv'
+
+
+def output_path(path, output_format=None):
+    # An explicit format replaces whatever known extension the path carries
+    if output_format is None:
+        return path, detect_format(path)
+    current_extension = output_formats[detect_format(path)][0]
+    if path.lower().endswith(current_extension):
+        path = path[:-len(current_extension)]
+    return path + output_formats[output_format][0], output_format
+
+
+def format_available(output_format):
+    package = output_formats[output_format][1]
+    return package is None or optional_packages[package] is not None
+
+
+def write_frame(df, path, output_format):
+    if output_format == 'parquet':
+        df.to_parquet(path, index=False, compression='zstd')
+    elif output_format == 'feather':
+        # Feather cannot store a custom index, and a filtered cube usually has one
+        df.reset_index(drop=True).to_feather(path)
+    elif output_format == 'csv.gz':
+        df.to_csv(path, index=False, compression='gzip')
+    elif output_format == 'csv.zst':
+        df.to_csv(path, index=False, compression='zstd')
+    else:
+        df.to_csv(path, index=False)
+
+
+def read_result(path):
+    output_format = detect_format(path)
+    if output_format == 'parquet':
+        return pd.read_parquet(path)
+    if output_format == 'feather':
+        return pd.read_feather(path)
+    return pd.read_csv(path)
+
+
+def write_result(df, path, output_format=None):
+    # Write to a temp file next to the target and rename it, so readers never see a partial result
+    path, output_format = output_path(path, output_format)
+    if not format_available(output_format):
+        package = output_formats[output_format][1]
+        raise ValueError(f"The {output_format} format needs the {package} package: pip install {package}")
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.tmp'
+    try:
+        write_frame(df, temp_path, output_format)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return path
+
+
+def synthetic_cube(rows, seed=0):
+    # Cube-shaped frame: repeated dimension labels and two measures, like a genre x year x person cube
+    rng = np.random.default_rng(seed)
+    genres = np.array(['Drama', 'Crime', 'Action', 'Comedy', 'Adventure', 'Biography', 'Animation', 'Mystery'])
+    return pd.DataFrame({
+        'genreName': genres[rng.integers(0, len(genres), rows)],
+        'year': rng.integers(1920, 2025, rows),
+        'name': np.char.add('Person ', rng.integers(0, max(rows // 20, 1), rows).astype(str)),
+        'averageRating': np.round(rng.uniform(1, 10, rows), 6),
+        'numVotes': rng.integers(0, 3_000_000, rows),
+    })
+
+
+def run_benchmark(rows, output_folder):
+    df = synthetic_cube(rows)
+    results = []
+    for output_format in output_formats:
+        if not format_available(output_format):
+            print(f"Skipping {output_format}: {output_formats[output_format][1]} is not installed.")
+            continue
+        start_time = time.perf_counter()
+        path = write_result(df, os.path.join(output_folder, 'benchmark_cube'), output_format)
+        write_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        read_back = read_result(path)
+        read_seconds = time.perf_counter() - start_time
+
+        results.append({
+            'format': output_format,
+            'write_seconds': write_seconds,
+            'read_seconds': read_seconds,
+            'size_mib': os.path.getsize(path) / 2 ** 20,
+            'rows_read': len(read_back),
+        })
+        os.remove(path)
+
+    results_df = pd.DataFrame(results)
+    csv_size = results_df.loc[results_df['format'] == 'csv', 'size_mib'].iloc[0]
+    results_df['size_vs_csv'] = results_df['size_mib'] / csv_size
+    return results_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cube result output formats on a synthetic cube.')
+    parser.add_argument('--benchmark', type=int, metavar='ROWS', help='Number of synthetic cube rows to write in every format.')
+    parser.add_argument('--output', default='../analysis_results/',
+                        help='Specify the folder for the temporary benchmark files. Default is "../analysis_results/".')
+
+    # Check if no arguments were provided (just the script name)
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    if args.benchmark:
+        print(run_benchmark(args.benchmark, args.output).to_string(index=False, float_format='{:.3f}'.format))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+def csr_from_pairs(rows, columns, row_count):
+    # Pairs must already be sorted by row; indptr[r]:indptr[r + 1] slices the columns of row r
+    indptr = np.zeros(row_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=row_count), out=indptr[1:])
+    return indptr, columns
+
+
+def csr_gather(indptr, indices, rows):
+    # Concatenate the column slices of several rows without a Python loop;
+    # also returns, for every gathered column, the position of its row in rows
+    starts = indptr[rows]
+    sizes = indptr[rows + 1] - starts
+    offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return indices[np.repeat(starts, sizes) + offsets], np.repeat(np.arange(len(rows)), sizes)
+
+
+def build_star_links(tables):
+    # Ordinal links shared by the bitmap indexes and the collaboration graph:
+    # fact row -> movie ordinal and person -> movies (CSR), over the DimMovie and DimPerson row order
+    movie_keys = tables['DimMovie']['movieId']
+    person_keys = tables['DimPerson']['personId']
+    principals_df = tables['Bridge_MoviePrincipals']
+
+    # A person credited twice on one movie (e.g. director and writer) is one membership
+    person_ordinals = pd.Index(person_keys).get_indexer(principals_df['personId'])
+    movie_ordinals = pd.Index(movie_keys).get_indexer(principals_df['movieId'])
+    matched = (person_ordinals >= 0) & (movie_ordinals >= 0)
+    memberships = np.unique(np.stack([person_ordinals[matched], movie_ordinals[matched]], axis=1), axis=0)
+
+    # np.unique left the memberships sorted by person, then movie
+    person_movie_indptr, person_movie_indices = csr_from_pairs(memberships[:, 0], memberships[:, 1].astype(np.int32), len(person_keys))
+
+    return {
+        'movie_keys': np.asarray(movie_keys, dtype=str),
+        'person_keys': np.asarray(person_keys, dtype=str),
+        'fact_movie_ordinals': pd.Index(movie_keys).get_indexer(tables['Fact_MovieData']['movieId']).astype(np.int32),
+        'person_movie_indptr': person_movie_indptr,
+        'person_movie_indices': person_movie_indices,
+    }
+
+
+def save_star_links(links, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(path, **links)
+
+
+def load_star_links(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def build_links_index(tables, path='../star_index/links.npz'):
+    # Built once per ETL run; the bitmap indexes and the collaboration graph both read this file
+    links = build_star_links(tables)
+    save_star_links(links, path)
+    return links
@@ -0,0 +1,197 @@
+import os
+import pandas as pd
+
+
+# Schema registry for every star table, in the order the tables have to be loaded.
+# Columns are (name, SQL type, pandas dtype, nullable). The registry generates the
+# DDL and drives dtype casting in the ETL, the validation rules and the loader.
+star_schema = {
+    'DimMovie': {
+        'columns': [
+            ('movieId', 'VARCHAR(255)', 'string', False),
+            ('titleType', 'VARCHAR(255)', 'category', False),
+            ('primaryTitle', 'VARCHAR(255)', 'string', False),
+            ('originalTitle', 'VARCHAR(255)', 'string', False),
+            ('isAdult', 'BIT', 'boolean', False),
+            ('startYear', 'INT', 'Int32', True),
+            ('endYear', 'INT', 'Int32', True),
+            ('runtimeMinutes', 'INT', 'Int32', True),
+        ],
+        'primary_key': ['movieId'],
+        'natural_key': ['movieId'],
+        'foreign_keys': {},
+    },
+    'DimGenre': {
+        'columns': [
+            ('genreId', 'INT', 'Int32', False),
+            ('genreName', 'VARCHAR(255)', 'category', False),
+        ],
+        'primary_key': ['genreId'],
+        'natural_key': ['genreId'],
+        'foreign_keys': {},
+    },
+    'DimDate': {
+        'columns': [
+            ('year', 'INT', 'Int32', False),
+            ('dateKey', 'INT', 'Int32', False),
+        ],
+        'primary_key': ['dateKey'],
+        'natural_key': ['dateKey'],
+        'foreign_keys': {},
+    },
+    'DimPerson': {
+        'columns': [
+            ('personId', 'VARCHAR(255)', 'string', False),
+            ('name', 'VARCHAR(255)', 'string', False),
+            ('birthYear', 'INT', 'Int32', True),
+            ('deathYear', 'INT', 'Int32', True),
+        ],
+        'primary_key': ['personId'],
+        'natural_key': ['personId'],
+        'foreign_keys': {},
+    },
+    'DimProfession': {
+        'columns': [
+            ('professionId', 'INT', 'Int32', False),
+            ('profession', 'VARCHAR(255)', 'category', False),
+        ],
+        'primary_key': ['professionId'],
+        'natural_key': ['professionId'],
+        'foreign_keys': {},
+    },
+    'Bridge_MovieGenres': {
+        'columns': [
+            ('movieId', 'VARCHAR(255)', 'string', False),
+            ('genreId', 'INT', 'Int32', False),
+        ],
+        'primary_key': ['movieId', 'genreId'],
+        'natural_key': ['movieId', 'genreId'],
+        'foreign_keys': {'movieId': ('DimMovie', 'movieId'), 'genreId': ('DimGenre', 'genreId')},
+    },
+    'Bridge_MoviePrincipals': {
+        'columns': [
+            ('principalId', 'INT', 'Int32', False),
+            ('movieId', 'VARCHAR(255)', 'string', False),
+            ('ordering', 'INT', 'Int32', True),
+            ('personId', 'VARCHAR(255)', 'string', False),
+            ('job', 'VARCHAR(255)', 'category', True),
+            ('characters', 'VARCHAR(255)', 'string', True),
+            ('professionId', 'INT', 'Int32', True),
+        ],
+        'primary_key': ['principalId'],
+        'natural_key': ['principalId'],
+        'foreign_keys': {'movieId': ('DimMovie', 'movieId'), 'personId': ('DimPerson', 'personId'),
+                         'professionId': ('DimProfession', 'professionId')},
+    },
+    'Bridge_PrincipalProfessions': {
+        'columns': [
+            ('personId', 'VARCHAR(255)', 'string', False),
+            ('professionId', 'INT', 'Int32', False),
+        ],
+        'primary_key': ['personId', 'professionId'],
+        'natural_key': ['personId', 'professionId'],
+        'foreign_keys': {'personId': ('DimPerson', 'personId'), 'professionId': ('DimProfession', 'professionId')},
+    },
+    'Fact_MovieData': {
+        'columns': [
+            ('factId', 'INT', 'Int32', False),
+            ('movieId', 'VARCHAR(255)', 'string', False),
+            ('dateKey', 'INT', 'Int32', False),
+            ('averageRating', 'FLOAT', 'float64', True),
+            ('numVotes', 'INT', 'Int32', True),
+        ],
+        'primary_key': ['factId'],
+        # factId is positional in the CSV, so changes are tracked per movie
+        'natural_key': ['movieId'],
+        'surrogate_key': 'factId',
+        'foreign_keys': {'movieId': ('DimMovie', 'movieId'), 'dateKey': ('DimDate', 'dateKey')},
+    },
+}
+
+# Star schema tables in load order, and their keys, from the schema registry
+star_table_names = list(star_schema)
+
+# Natural key of every star table, used for change detection and upserts
+star_table_keys = {table: schema['natural_key'] for table, schema in star_schema.items()}
+
+# Surrogate keys are positional in the CSVs, so they are assigned by the database on insert
+star_surrogate_keys = {table: schema['surrogate_key'] for table, schema in star_schema.items() if 'surrogate_key' in schema}
+
+# Placeholders the source and star CSV files use for missing values
+NULL_MARKERS = ['NULL', '\\N', '']
+
+
+def column_names(table):
+    return [column[0] for column in star_schema[table]['columns']]
+
+
+def column_dtypes(table):
+    return {name: dtype for name, _, dtype, _ in star_schema[table]['columns']}
+
+
+def create_table_ddl(table):
+    # Generate the IF NOT EXISTS CREATE TABLE statement for a star table
+    schema = star_schema[table]
+    definitions = [f"{name} {sql_type} {'NULL' if nullable else 'NOT NULL'}" for name, sql_type, _, nullable in schema['columns']]
+    definitions.append(f"PRIMARY KEY ({', '.join(schema['primary_key'])})")
+    for column, (parent_table, parent_column) in schema['foreign_keys'].items():
+        definitions.append(f'FOREIGN KEY ({column}) REFERENCES {parent_table}({parent_column})')
+
+    separator = ',\n        '
+    return f"""
+    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[{table}]') AND type in (N'U'))
+    CREATE TABLE {table} (
+        {separator.join(definitions)}
+    )
+    """
+
+
+def cast_frame(df, table):
+    # Cast whole columns to the registry dtypes; NULL markers become <NA>
+    df = df[column_names(table)].replace(NULL_MARKERS, pd.NA)
+    for name, dtype in column_dtypes(table).items():
+        if dtype in ('Int32', 'float64'):
+            df[name] = pd.to_numeric(df[name]).astype(dtype)
+        elif dtype == 'boolean':
+            df[name] = df[name].replace({'True': True, 'False': False}).astype('boolean')
+        else:
+            df[name] = df[name].astype(dtype)
+    return df
+
+
+def read_star_csv(table, csv_path):
+    # Parse straight into the registry dtypes; only the NULL markers count as missing
+    return pd.read_csv(csv_path, usecols=column_names(table), dtype=column_dtypes(table),
+                       na_values=NULL_MARKERS, keep_default_na=False)[column_names(table)]
+
+
+def load_star_tables(data_folder):
+    # Read every star table CSV into the registry dtypes
+    return {name: read_star_csv(name, os.path.join(data_folder, name + '.csv')) for name in star_table_names}
+
+
+def write_star_csv(df, table, csv_path):
+    # Keep the 'NULL' placeholder the star CSV files have always used
+    df[column_names(table)].to_csv(csv_path, index=False, na_rep='NULL')
+
+
+# Bytes of one non-NULL value of each fixed-size SQL type, as bound for the INSERT parameters
+sql_value_bytes = {'INT': 4, 'FLOAT': 8, 'BIT': 1}
+
+
+def sql_payload_bytes(df, table):
+    # Parameter bytes sent for these rows: fixed-size values plus the encoded VARCHAR text; NULLs send none
+    total = 0
+    for name, sql_type, _, _ in star_schema[table]['columns']:
+        values = df[name].dropna()
+        if sql_type in sql_value_bytes:
+            total += sql_value_bytes[sql_type] * len(values)
+        else:
+            total += int(values.str.encode('utf-8').str.len().sum())
+    return total
+
+
+def to_sql_rows(df, table):
+    # Native Python values with None for <NA>, converted column-wise for pyodbc
+    df = df[column_names(table)].astype(object)
+    return df.where(df.notna(), None).values.tolist()
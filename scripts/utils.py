@@ -1,8 +1,14 @@
 import os
-import pyodbc
+from collections import OrderedDict
 import pandas as pd
 from dotenv import load_dotenv
 
+try:
+    import pyodbc
+except ImportError:
+    # Only database access needs the ODBC driver; the local cube engine imports utils without it
+    pyodbc = None
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -43,10 +49,131 @@ dim_table_map = {
     'Bridge_PrincipalProfessions': ('Bridge_PrincipalProfessions', 'Bridge_MoviePrincipals.personId = Bridge_PrincipalProfessions.personId', 'bridge'),
 }
 
-def execute_sql_query(query):
-    # Connect to the database
-    with pyodbc.connect(CONN_STRING) as conn:
-        # Execute the query and fetch the results
-        df = pd.read_sql(query, conn)
+# Fact measures; cube state and summary tables carry a sum and a count for each
+fact_measures = ['averageRating', 'numVotes']
+
+# Server-side summary tables holding that sum/count state, refreshed by every load.
+# Listed from the smallest to the largest, so the navigator picks the first match.
+aggregate_table_map = {
+    'Agg_Fact_Genre': ['genreName'],
+    'Agg_Fact_Profession': ['profession'],
+    'Agg_Fact_Year': ['year'],
+    'Agg_Fact_GenreYear': ['genreName', 'year'],
+    'Agg_Fact_Person': ['name'],
+}
+
+# Dimension hierarchies, listed from the finest level to the coarsest one.
+# Derived levels are computed locally from the level directly below them, so
+# a cube cached at a finer level can be rolled up without a new database scan.
+dim_hierarchies = {
+    'year': ['year', 'decade', 'era'],
+    'runtimeMinutes': ['runtimeMinutes', 'runtimeBucket'],
+}
+
+# Era boundaries (inclusive start year) and runtime buckets (upper bound in minutes)
+era_bounds = [(0, 'Silent'), (1930, 'Golden Age'), (1960, 'New Hollywood'), (1980, 'Blockbuster'), (2000, 'Modern')]
+runtime_buckets = [(90, '<90'), (120, '90-119'), (150, '120-149'), (180, '150-179'), (float('inf'), '180+')]
+
+
+# Shared connection and one cursor per distinct statement text. pyodbc keeps a
+# statement prepared on its cursor, so re-running the same cube shape with new
+# parameter values skips the prepare step and reuses the server plan.
+STATEMENT_CACHE_SIZE = 64
+statement_cache = OrderedDict()
+statement_cache_stats = {'hits': 0, 'misses': 0}
+shared_connection = None
+
+
+def get_connection():
+    global shared_connection
+    if shared_connection is None:
+        if pyodbc is None:
+            raise ImportError('pyodbc and the ODBC Driver 17 for SQL Server are needed for database access.')
+        shared_connection = pyodbc.connect(CONN_STRING, autocommit=True)
+    return shared_connection
+
+
+def get_statement_cursor(query):
+    cursor = statement_cache.get(query)
+    if cursor is not None:
+        statement_cache_stats['hits'] += 1
+        statement_cache.move_to_end(query)
+        return cursor
+
+    statement_cache_stats['misses'] += 1
+    cursor = get_connection().cursor()
+    statement_cache[query] = cursor
+    # Evict the least recently used statement once the cache is full
+    if len(statement_cache) > STATEMENT_CACHE_SIZE:
+        _, evicted_cursor = statement_cache.popitem(last=False)
+        evicted_cursor.close()
+    return cursor
+
+
+def execute_sql_query(query, params=None):
+    # pyodbc only prepares statements that bind parameters, so only those go
+    # through the statement cache; parameterless SQL is executed directly
+    if params:
+        cursor = get_statement_cursor(query)
+        cursor.execute(query, params)
+    else:
+        cursor = get_connection().cursor()
+        cursor.execute(query)
+
+    # Fetch the results
+    columns = [column[0] for column in cursor.description]
+    df = pd.DataFrame.from_records([tuple(row) for row in cursor.fetchall()], columns=columns)
+
+    if not params:
+        cursor.close()
+    return df
+
+
+# Summary tables the last load refreshed successfully, read once per process
+ready_aggregate_tables = None
+
+
+def get_ready_aggregate_tables():
+    # Databases loaded before the summary tables existed have no refresh log,
+    # and a failed refresh leaves its table out of it; both fall back to the star
+    global ready_aggregate_tables
+    if ready_aggregate_tables is None:
+        ready_df = execute_sql_query("""
+        IF OBJECT_ID(N'[dbo].[etl_AggregateRefresh]', N'U') IS NULL
+            SELECT CAST(NULL AS VARCHAR(255)) AS tableName WHERE 1 = 0
+        ELSE
+            SELECT tableName FROM etl_AggregateRefresh WHERE OBJECT_ID(tableName, N'U') IS NOT NULL
+        """)
+        ready_aggregate_tables = set(ready_df['tableName'])
+    return ready_aggregate_tables
+
+
+def get_server_plan_usage():
+    # Use counts of prepared plans in the server plan cache (needs VIEW SERVER STATE)
+    cursor = get_connection().cursor()
+    cursor.execute("""
+    SELECT cp.usecounts, st.text
+    FROM sys.dm_exec_cached_plans cp
+    CROSS APPLY sys.dm_exec_sql_text(cp.plan_handle) st
+    WHERE cp.objtype = 'Prepared' AND st.text LIKE '%Fact[_]%'
+    ORDER BY cp.usecounts DESC
+    """)
+    rows = [tuple(row) for row in cursor.fetchall()]
+    cursor.close()
+    return pd.DataFrame.from_records(rows, columns=['usecounts', 'text'])
+
+
+def report_statement_cache():
+    # Hits and misses count parameterized executions only
+    print(f"Statement cache: {statement_cache_stats['hits']} hits, {statement_cache_stats['misses']} misses, "
+          f"{len(statement_cache)} prepared statements")
+    if not statement_cache:
+        return
 
-    return df
\ No newline at end of file
+    # Confirm the reuse on the server side; the plan cache DMVs need VIEW SERVER STATE
+    try:
+        plans_df = get_server_plan_usage()
+    except pyodbc.Error as e:
+        print(f"Server plan usage unavailable: {e}")
+        return
+    print(f"Server plan cache: {len(plans_df)} prepared cube plans, used {int(plans_df['usecounts'].sum())} times in total")
@@ -0,0 +1,126 @@
+import os
+import argparse
+from contextlib import nullcontext
+import pandas as pd
+from star_schema import star_schema, star_table_names, star_table_keys, star_surrogate_keys, NULL_MARKERS
+from etl_metrics import start_run, finish_run, track_stage, record_rows
+from delta_etl import write_star_deltas
+
+
+def validation_rules(table):
+    # Derive the column rules from the schema registry; VARCHAR(255) columns are length-checked
+    columns = star_schema[table]['columns']
+    return {
+        'required': [name for name, _, _, nullable in columns if not nullable],
+        'integer': [name for name, _, dtype, _ in columns if dtype == 'Int32'],
+        'float': [name for name, _, dtype, _ in columns if dtype == 'float64'],
+        'boolean': [name for name, _, dtype, _ in columns if dtype == 'boolean'],
+        'text': [name for name, sql_type, _, _ in columns if sql_type == 'VARCHAR(255)'],
+        'foreign_keys': star_schema[table]['foreign_keys'],
+    }
+
+
+TEXT_MAX_LENGTH = 255
+# SQL Server INT, which the Int32 columns load into; larger values would wrap in the cast
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def null_mask(column):
+    return column.isin(NULL_MARKERS)
+
+
+def add_reason(reasons, mask, reason):
+    # Append a reason to every rejected row without looping over rows
+    return reasons.where(~mask, reasons + reason + '; ')
+
+
+def validate_table(table, table_df, clean_tables):
+    rules = validation_rules(table)
+    reasons = pd.Series('', index=table_df.index)
+
+    for column in rules.get('required', []):
+        reasons = add_reason(reasons, null_mask(table_df[column]), f'{column} is NULL')
+
+    for column in rules.get('integer', []):
+        present = ~null_mask(table_df[column])
+        numbers = pd.to_numeric(table_df[column].where(present), errors='coerce')
+        reasons = add_reason(reasons, present & (numbers.isna() | (numbers % 1 != 0)), f'{column} is not an integer')
+        reasons = add_reason(reasons, present & ((numbers < INT_MIN) | (numbers > INT_MAX)), f'{column} is outside the INT range')
+
+    for column in rules.get('float', []):
+        present = ~null_mask(table_df[column])
+        numbers = pd.to_numeric(table_df[column].where(present), errors='coerce')
+        reasons = add_reason(reasons, present & numbers.isna(), f'{column} is not a number')
+
+    for column in rules.get('boolean', []):
+        reasons = add_reason(reasons, ~table_df[column].isin(['True', 'False']), f'{column} is not True/False')
+
+    for column in rules.get('text', []):
+        reasons = add_reason(reasons, table_df[column].str.len() > TEXT_MAX_LENGTH, f'{column} is longer than {TEXT_MAX_LENGTH}')
+
+    # Keep the first row of every natural or surrogate key and quarantine the repeats
+    unique_keys = [star_table_keys[table]] + ([[star_surrogate_keys[table]]] if table in star_surrogate_keys else [])
+    for keys in unique_keys:
+        reasons = add_reason(reasons, table_df.duplicated(keys, keep='first'), f"duplicate key ({', '.join(keys)})")
+
+    # Foreign keys are checked against the already validated parent tables; NULLs are allowed
+    for column, (parent_table, parent_column) in rules.get('foreign_keys', {}).items():
+        present = ~null_mask(table_df[column])
+        missing = ~table_df[column].isin(clean_tables[parent_table][parent_column])
+        reasons = add_reason(reasons, present & missing, f'{column} not found in {parent_table}')
+
+    rejected = reasons != ''
+    clean_df = table_df[~rejected]
+    quarantine_df = table_df[rejected].assign(rejectReason=reasons[rejected].str.rstrip('; '))
+    return clean_df, quarantine_df
+
+
+def validate_star(data_folder, output_folder, quarantine_folder, run=None, stage=None):
+    # Parents come first in star_table_names, so child rows are checked against clean parents only
+    os.makedirs(output_folder, exist_ok=True)
+    os.makedirs(quarantine_folder, exist_ok=True)
+    clean_tables = {}
+    rows_in = 0
+
+    for table in star_table_names:
+        # Inside a caller's stage, per-table stages would reset its peak RSS, so only count into it
+        tracked = track_stage(run, table, output_path=os.path.join(output_folder, table + '.csv')) if stage is None else nullcontext()
+        with tracked as table_stage:
+            table_df = pd.read_csv(os.path.join(data_folder, table + '.csv'), dtype=str, keep_default_na=False)
+            clean_df, quarantine_df = validate_table(table, table_df, clean_tables)
+            clean_tables[table] = clean_df
+
+            clean_df.to_csv(os.path.join(output_folder, table + '.csv'), index=False)
+            quarantine_path = os.path.join(quarantine_folder, table + '.csv')
+            if len(quarantine_df):
+                quarantine_df.to_csv(quarantine_path, index=False)
+                print(f"{table}: {len(quarantine_df)} rows quarantined to {quarantine_path}")
+            elif os.path.exists(quarantine_path):
+                os.remove(quarantine_path)
+            record_rows(table_stage, rows_in=len(table_df), rows_out=len(clean_df))
+            rows_in += len(table_df)
+
+    record_rows(stage, rows_in=rows_in, rows_out=sum(len(clean_df) for clean_df in clean_tables.values()))
+    return clean_tables
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Validate the star schema CSV files before they are loaded.')
+    parser.add_argument('--data', default='../datasets_star/',
+                        help='Specify the folder holding the star schema CSV files. Default is "../datasets_star/".')
+    parser.add_argument('--output', default='../datasets_validated/',
+                        help='Specify the folder for the validated CSV files. Default is "../datasets_validated/".')
+    parser.add_argument('--quarantine', default='../datasets_quarantine/',
+                        help='Specify the folder for rejected rows. Default is "../datasets_quarantine/".')
+    parser.add_argument('--delta', action='store_true',
+                        help='Also write the deltas of the validated tables against the last loaded snapshot.')
+    args = parser.parse_args()
+
+    run = start_run('validate_star')
+    try:
+        validate_star(args.data, args.output, args.quarantine, run=run)
+        if args.delta:
+            with track_stage(run, 'delta_detection'):
+                write_star_deltas(args.output)
+    finally:
+        finish_run(run)